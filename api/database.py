@@ -1,14 +1,23 @@
 import os
+import base64
+from datetime import datetime, timezone
 from sqlalchemy import (
     create_engine,
     Column,
+    Integer,
     String,
     Text,
     TIMESTAMP,
     UniqueConstraint,
+    REAL,
+    cast,
+    literal,
+    select,
+    tuple_,
+    true,
 )
-from sqlalchemy.dialects.postgresql import ARRAY as PG_ARRAY
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
+from sqlalchemy.dialects.postgresql import ARRAY as PG_ARRAY, JSONB, TSVECTOR, array
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session, Session
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
 from sqlalchemy.ext.mutable import MutableList
@@ -24,7 +33,15 @@ DATABASE_URL = (
 )
 
 # Create SQLAlchemy engine with AUTOCOMMIT for read-only selects
-engine = create_engine(DATABASE_URL, echo=False, isolation_level="AUTOCOMMIT")
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    isolation_level="AUTOCOMMIT",
+    pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+    pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+)
 
 
 @event.listens_for(engine, "connect")
@@ -77,7 +94,57 @@ SessionLocal = sessionmaker(
     class_=ReadOnlySession,
     autoflush=False,
 )
-session = SessionLocal()
+# One session per thread (i.e. per request), main.py removes it on teardown
+session = scoped_session(SessionLocal)
+
+
+def listen_connection():
+    """Dedicated DBAPI connection, kept out of the pool, for LISTEN."""
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    return engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+
+
+def encode_cursor(post):
+    """Opaque cursor pointing just after `post` in (timestamp, message_id) order."""
+    raw = f"{post.timestamp.isoformat()}|{post.message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _cursor_timestamp(value):
+    """Timestamp of a cursor in UTC: Postgres rejects offsets beyond 15:59."""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raises ValueError on malformed input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|", 1)
+        return _cursor_timestamp(timestamp), message_id
+    except (ValueError, UnicodeDecodeError, OverflowError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def encode_search_cursor(row):
+    """Like encode_cursor, for /search results ordered by rank first."""
+    raw = f"{row.rank!r}|{row.timestamp.isoformat()}|{row.message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        rank, timestamp, message_id = raw.split("|", 2)
+        return float(rank), _cursor_timestamp(timestamp), message_id
+    except (ValueError, UnicodeDecodeError, OverflowError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+# Must match SEARCH_CONFIG in bot/database.py, which generates search_vector
+SEARCH_CONFIG = "english"
 
 
 class Post(Base):
@@ -91,6 +158,10 @@ class Post(Base):
     )
     tags = Column(MutableList.as_mutable(PG_ARRAY(String)), default=list)
     files = Column(MutableList.as_mutable(PG_ARRAY(String)), default=list)
+    # Normalized files written by the bot, NULL on rows not backfilled yet
+    file_refs = Column(JSONB)
+    # Generated from message by Postgres
+    search_vector = Column(TSVECTOR)
 
     __table_args__ = (
         UniqueConstraint("author", "timestamp", name="uq_author_timestamp"),
@@ -102,35 +173,190 @@ class Post(Base):
         return session.query(cls).filter_by(message_id=id_).first()
 
     @classmethod
-    def get_by_author(cls, author, limit=50, offset=0):
-        return session.query(cls).filter_by(author=author).order_by(cls.timestamp.desc()).limit(limit).offset(offset).all()
+    def _page(cls, query, limit, offset=0, cursor=None):
+        """Newest first. `cursor` (keyset) takes precedence over the legacy `offset`."""
+        query = query.order_by(cls.timestamp.desc(), cls.message_id.desc())
+        if cursor:
+            timestamp, message_id = decode_cursor(cursor)
+            query = query.filter(
+                tuple_(cls.timestamp, cls.message_id) < (timestamp, message_id)
+            )
+        elif offset:
+            query = query.offset(offset)
+        return query.limit(limit)
 
     @classmethod
-    def get_latests(cls, limit=50):
-        return (
-            session.query(cls)
-            .order_by(cls.timestamp.desc())
-            .limit(limit)
-            .all()
+    def _rows(cls, where, limit, offset=0, cursor=None):
+        """Plain rows with only the columns listings need, no ORM hydration."""
+        stmt = select(
+            cls.message_id, cls.message, cls.tags, cls.timestamp, cls.files, cls.file_refs
         )
+        if where is not None:
+            stmt = stmt.where(where)
+        return session.execute(cls._page(stmt, limit, offset, cursor)).all()
+
+    @classmethod
+    def get_by_author_rows(cls, author, limit=50, offset=0, cursor=None):
+        return cls._rows(cls.author == author, limit, offset, cursor)
+
+    @classmethod
+    def get_latests_rows(cls, limit=50, cursor=None):
+        return cls._rows(None, limit, cursor=cursor)
 
     @classmethod
-    def get_by_tag(cls, tag, limit=50, offset=0):
+    def get_by_tag_rows(cls, tag, limit=50, offset=0, cursor=None):
         limit = min(limit, 100)
-        return (
-            session.query(cls)
-            .filter(cls.tags.contains([tag]))
-            .order_by(cls.timestamp.desc())
-            .offset(offset)
+        return cls._rows(cls.tags.contains([tag]), limit, offset, cursor)
+
+    @classmethod
+    def get_by_ids_rows(cls, ids):
+        """Listing rows of the posts in `ids`, in one query. Unknown ids are left out."""
+        stmt = select(
+            cls.message_id, cls.message, cls.tags, cls.timestamp, cls.files, cls.file_refs
+        ).where(cls.message_id == func.any(literal(list(ids), PG_ARRAY(String))))
+        return session.execute(stmt).all()
+
+    @classmethod
+    def _rows_per_key(cls, keys, match, limit):
+        """Newest `limit` rows for each of `keys`, in one query.
+
+        `match(key)` is the filter of one feed. Rows carry a trailing `key`
+        column. A LATERAL subquery per key lets each one stop after `limit`
+        rows on an index, where a row_number() window would number every
+        matching post first.
+        """
+        key_table = func.unnest(literal(list(keys), PG_ARRAY(String))).table_valued("key").render_derived("k")
+        feed = (
+            select(cls.message_id, cls.message, cls.tags, cls.timestamp, cls.files, cls.file_refs)
+            .where(match(key_table.c.key))
+            .order_by(cls.timestamp.desc(), cls.message_id.desc())
             .limit(limit)
-            .all()
+            .lateral("feed")
+        )
+        stmt = select(*feed.c, key_table.c.key).select_from(key_table).join(feed, true())
+        return session.execute(stmt).all()
+
+    @classmethod
+    def get_by_authors_rows(cls, authors, limit=20):
+        return cls._rows_per_key(authors, lambda author: cls.author == author, min(limit, 100))
+
+    @classmethod
+    def get_by_tags_rows(cls, tags, limit=20):
+        # tags @> ARRAY[tag], which can use the GIN index
+        return cls._rows_per_key(tags, lambda tag: cls.tags.contains(array([tag])), min(limit, 100))
+
+    @classmethod
+    def search_rows(cls, q, limit=50, cursor=None, tag=None, author=None):
+        """Posts whose message matches `q`, best match first.
+
+        `q` uses the web search syntax ("quoted phrase", -excluded, or).
+        Rows carry a trailing `rank` column, pages are keyed on
+        (rank, timestamp, message_id) with encode_search_cursor.
+        """
+        limit = min(limit, 100)
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        rank = func.ts_rank_cd(cls.search_vector, query)
+
+        stmt = select(
+            cls.message_id,
+            cls.message,
+            cls.tags,
+            cls.timestamp,
+            cls.files,
+            cls.file_refs,
+            rank.label("rank"),
+        ).where(cls.search_vector.op("@@")(query))
+        if tag:
+            stmt = stmt.where(cls.tags.contains([tag]))
+        if author:
+            stmt = stmt.where(cls.author == author)
+        if cursor:
+            last_rank, timestamp, message_id = decode_search_cursor(cursor)
+            # ts_rank_cd returns a real, compare against a real so the
+            # cursor's rank round-trips exactly
+            stmt = stmt.where(
+                tuple_(rank, cls.timestamp, cls.message_id)
+                < tuple_(cast(literal(last_rank), REAL), literal(timestamp, cls.timestamp.type), literal(message_id))
+            )
+
+        stmt = stmt.order_by(rank.desc(), cls.timestamp.desc(), cls.message_id.desc()).limit(limit)
+        return session.execute(stmt).all()
+
+    @classmethod
+    def export_rows(cls, since=None, until=None, tag=None, author=None, batch_size=1000):
+        """Yield batches of rows, oldest first, from a server-side cursor.
+
+        Memory stays at one batch whatever the size of the range. Rows
+        carry the listing columns plus `author`. The connection is held
+        until the generator is exhausted or closed.
+        """
+        stmt = select(
+            cls.message_id, cls.message, cls.tags, cls.timestamp, cls.files, cls.file_refs, cls.author
         )
+        if since is not None:
+            stmt = stmt.where(cls.timestamp >= since)
+        if until is not None:
+            stmt = stmt.where(cls.timestamp < until)
+        if tag:
+            stmt = stmt.where(cls.tags.contains([tag]))
+        if author:
+            stmt = stmt.where(cls.author == author)
+        stmt = stmt.order_by(cls.timestamp, cls.message_id)
+
+        # psycopg2 named cursors only live inside a transaction, which the
+        # AUTOCOMMIT engine would not open
+        with engine.connect() as conn:
+            conn.execution_options(
+                isolation_level="READ COMMITTED", stream_results=True, yield_per=batch_size
+            )
+            yield from conn.execute(stmt).partitions()
+
+
+# Summary tables maintained by triggers on posts, see bot/database.py
+
+
+class TagStat(Base):
+    __tablename__ = "tag_stats"
 
-    def asdict(self):
-        return {
-            "content": self.message,
-            "message_id": self.message_id,
-            "tags": self.tags,
-            "timestamp": int(self.timestamp.timestamp()),
-            "files": self.files
-        }
+    tag = Column(String, primary_key=True)
+    posts = Column(Integer, nullable=False)
+
+    @classmethod
+    def top(cls, limit=50, offset=0):
+        """(tag, posts) pairs, most used first."""
+        return session.execute(
+            select(cls.tag, cls.posts)
+            .where(cls.posts > 0)
+            .order_by(cls.posts.desc(), cls.tag)
+            .limit(limit)
+            .offset(offset)
+        ).all()
+
+
+class AuthorStat(Base):
+    __tablename__ = "author_stats"
+
+    author = Column(String(64), primary_key=True)
+    posts = Column(Integer, nullable=False)
+
+    @classmethod
+    def posts_of(cls, author):
+        return session.execute(select(cls.posts).where(cls.author == author)).scalar() or 0
+
+
+class AuthorTagStat(Base):
+    __tablename__ = "author_tag_stats"
+
+    author = Column(String(64), primary_key=True)
+    tag = Column(String, primary_key=True)
+    posts = Column(Integer, nullable=False)
+
+    @classmethod
+    def top(cls, author, limit=20):
+        """(tag, posts) pairs of `author`, most used first."""
+        return session.execute(
+            select(cls.tag, cls.posts)
+            .where(cls.author == author, cls.posts > 0)
+            .order_by(cls.posts.desc(), cls.tag)
+            .limit(limit)
+        ).all()
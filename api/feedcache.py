@@ -0,0 +1,173 @@
+import os
+import json
+import select
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Channel the bot notifies on after every write to the posts table
+NOTIFY_CHANNEL = "posts_changed"
+
+
+class FeedCache:
+    """TTL + LRU cache of serialized feed responses.
+
+    Every entry is tagged with the feeds it belongs to, e.g. ("tag", "rust")
+    or ("author", "U123"), so a change to a post only evicts the entries
+    that could contain it. ("latests",) entries are evicted on any change.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped on every invalidation, see set()
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, deps)
+        self._by_dep = {}  # dep -> set of keys
+        self._listener_pid = None
+
+    def listen(self, connect):
+        """Start the invalidation listener once per process.
+
+        Called lazily from request handlers, so a listener is also started
+        in workers forked after the app was imported.
+        """
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        ChangeListener(self, connect).start()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, deps, generation=None):
+        """Store `value` under `key`.
+
+        Pass the `generation` read before running the query: if anything
+        was invalidated in the meantime the value may already be stale and
+        is not stored.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, deps)
+            for dep in deps:
+                self._by_dep.setdefault(dep, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, author=None, tags=(), all_tags=False):
+        """Evict every entry that may contain a post by `author` or with `tags`.
+
+        `all_tags` evicts every tag feed, for changes whose tags did not
+        fit in the notification.
+        """
+        deps = [("latests",)]
+        if author is not None:
+            deps.append(("author", author))
+        deps.extend(("tag", tag) for tag in tags)
+
+        with self._lock:
+            if all_tags:
+                deps.extend(dep for dep in self._by_dep if dep[0] == "tag")
+            self.generation += 1
+            for dep in deps:
+                for key in list(self._by_dep.get(dep, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_dep.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for dep in entry[2]:
+            keys = self._by_dep.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_dep[dep]
+
+
+class ChangeListener(threading.Thread):
+    """LISTENs for post changes and evicts the affected cache entries.
+
+    `connect` must return a DBAPI (psycopg2) connection. Notifications sent
+    while the listener is disconnected are lost, so the whole cache is
+    cleared every time it (re)connects.
+    """
+
+    def __init__(self, cache, connect, poll_interval=5.0, retry_interval=5.0):
+        super().__init__(name="feed-cache-listener", daemon=True)
+        self.cache = cache
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Feed cache listener lost its connection")
+            self.cache.clear()
+            time.sleep(self.retry_interval)
+
+    def _listen(self):
+        conn = self.connect()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            self.cache.clear()
+
+            while True:
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._handle(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def _handle(self, payload):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            # Unknown payload, play it safe
+            self.cache.clear()
+            return
+        self.cache.invalidate(
+            author=change.get("author"),
+            tags=change.get("tags") or (),
+            all_tags=bool(change.get("all_tags")),
+        )
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+# Temporary files older than this are considered abandoned
+STALE_TMP_SECONDS = 3600
+
+
+def file_path(id_, filename):
+    """``<file id>/<filename>`` relative path, None if a part could leave the directory."""
+    for part in (id_, filename):
+        if part in ("", ".", "..") or "/" in part or os.sep in part:
+            return None
+    return os.path.join(id_, filename)
+
+
+class FileCache:
+    """Size-bounded on-disk LRU cache for proxied Slack files.
+
+    Files are stored as ``<directory>/<file id>/<filename>``. Writes go to a
+    temporary file first and are moved into place with ``os.replace`` so a
+    reader never sees a partial file.
+
+    The size is tracked by each process: workers sharing a directory each
+    keep their own index and evict against their own ``max_bytes``, so the
+    directory can grow to the number of workers times ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index files left over from a previous run, oldest first."""
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(".tmp-"):
+                    # Another worker may still be writing it, only drop old ones
+                    if st.st_mtime < time.time() - STALE_TMP_SECONDS:
+                        os.unlink(path)
+                    continue
+                found.append((st.st_mtime, os.path.relpath(path, self.directory), st.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+
+        with self._lock:
+            self._evict()
+
+    _key = staticmethod(file_path)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, id_, filename):
+        """Return the path of a cached file, or None on a miss."""
+        key = self._key(id_, filename)
+        if key is None:
+            return None
+
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            if key not in self._entries and os.path.isfile(path):
+                # Written by another worker sharing the same directory
+                self._entries[key] = os.path.getsize(path)
+                self._size += self._entries[key]
+
+            if key in self._entries and os.path.isfile(path):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return path
+
+            self._forget(key)
+            self.misses += 1
+            return None
+
+    def open(self, id_, filename, expected_size=None):
+        """Start writing a file into the cache.
+
+        Returns a CacheWriter, or None if the file cannot be cached.
+        """
+        key = self._key(id_, filename)
+        if key is None:
+            return None
+        if expected_size is not None and expected_size > self.max_bytes:
+            return None
+        return CacheWriter(self, key)
+
+    def _commit(self, key, tmp_path, size):
+        path = os.path.join(self.directory, key)
+        if size > self.max_bytes:
+            os.unlink(tmp_path)
+            return
+
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.unlink(os.path.join(self.directory, key))
+            except FileNotFoundError:
+                pass
+
+
+class CacheWriter:
+    """Temporary file that becomes a cache entry once commit() is called."""
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+        self._size = 0
+
+        directory = os.path.join(cache.directory, os.path.dirname(key))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._size += len(chunk)
+
+    def commit(self):
+        self._file.close()
+        self._cache._commit(self._key, self._tmp_path, self._size)
+        self._tmp_path = None
+
+    def discard(self):
+        if self._tmp_path is None:
+            return
+        self._file.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+        self._tmp_path = None
@@ -1,23 +1,218 @@
-from flask import Flask, Response, request
+from flask import Flask, Response, request, send_file, abort
+from upstream import UpstreamClient
+from feedcache import FeedCache
+from filecache import FileCache, file_path
+from thumbnails import Thumbnailer, FORMATS
+import metrics
 from dotenv import load_dotenv
 from database import *
+from datetime import datetime, timezone
+import mimetypes
 import requests
+import hashlib
+import gzip
+import threading
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
 
 load_dotenv()
 app = Flask(__name__)
+metrics.init_app(app)
+metrics.instrument_engine(engine, slow_query_ms=float(os.getenv("DB_SLOW_QUERY_MS", 200)))
 public_preffix = os.getenv("PUBLIC_PREFIX", "http://127.0.0.1:5000/")
 
+slack_files_url = os.getenv("SLACK_FILES_URL", "https://files.slack.com/files-pri/")
+
 headers = {"Authorization": f"Bearer {os.getenv('SLACK_BOT_TOKEN')}"}
 
+upstream = UpstreamClient(
+    pool_size=int(os.getenv("UPSTREAM_POOL_SIZE", 20)),
+    connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", 30)),
+    retries=int(os.getenv("UPSTREAM_RETRIES", 2)),
+)
+
+# Local copy of proxied files, disabled when FILE_CACHE_DIR is empty
+file_cache = None
+if os.getenv("FILE_CACHE_DIR", "cache"):
+    file_cache = FileCache(
+        os.getenv("FILE_CACHE_DIR", "cache"),
+        max_bytes=int(os.getenv("FILE_CACHE_MAX_BYTES", 1024 * 1024 * 1024)),
+    )
+
+# Serialized /latests, /tag and /user responses, disabled when FEED_CACHE_TTL is 0
+feed_cache = None
+if float(os.getenv("FEED_CACHE_TTL", 30)) > 0:
+    feed_cache = FeedCache(
+        max_entries=int(os.getenv("FEED_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("FEED_CACHE_TTL", 30)),
+    )
+
+# Files the bot mirrored at ingest (bot/media.py), served without asking Slack
+media_store_dir = os.getenv("MEDIA_STORE_DIR") or None
+mirror_stats = {"hits": 0, "misses": 0}
+mirror_stats_lock = threading.Lock()
+
+PROXY_CHUNK_SIZE = 64 * 1024
+# Request headers passed through to Slack so seeking in videos works
+PROXY_REQUEST_HEADERS = ("Range", "If-Range")
+# Response headers passed back from Slack to the client
+PROXY_RESPONSE_HEADERS = (
+    "Content-Length",
+    "Content-Encoding",
+    "Content-Range",
+    "Accept-Ranges",
+    "ETag",
+    "Last-Modified",
+)
+
+
+SLACK_FILE_PREFIX = "https://files.slack.com/files-pri/"
+
+# How each file_refs "source" becomes a public URL
+FILE_URL_BUILDERS = {
+    "slack": lambda ref: f"{public_preffix}file/{ref['id']}/{ref['name']}",
+    "url": lambda ref: ref["url"],
+}
+
+
+def legacy_file_url(url):
+    """Proxy URL for a raw `files` entry, for rows without file_refs."""
+    if url.startswith(SLACK_FILE_PREFIX):
+        return public_preffix + "file/" + url[len(SLACK_FILE_PREFIX):]
+    return url
+
+
+def post_dict(message_id, message, tags, timestamp, files, file_refs, *_):
+    """Public shape of a post in every listing."""
+    return {
+        "content": message,
+        "message_id": message_id,
+        "tags": tags,
+        "timestamp": int(timestamp.timestamp()),
+        "files": (
+            [FILE_URL_BUILDERS[ref["source"]](ref) for ref in file_refs]
+            if file_refs is not None
+            else [legacy_file_url(file) for file in files or ()]
+        ),
+    }
+
+
+def serialize_rows(rows):
+    """JSON list of the rows, built in one pass without ORM objects."""
+    return dumps([post_dict(*row) for row in rows])
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    # Hands the connection back to the pool and drops the identity map
+    session.remove()
+
+
+def page_args():
+    """limit/offset/cursor query arguments shared by the listing endpoints."""
+    # Negative values would reach SQL and fail there
+    return {
+        "limit": max(1, request.args.get("limit", 50, type=int)),
+        "offset": max(0, request.args.get("offset", 0, type=int)),
+        "cursor": request.args.get("cursor") or None,
+    }
+
 
-def fix_links(posts):
-    for post in posts:
-        files = post.get("files", [])
-        for i, file in enumerate(files):
-            if file.startswith("https://files.slack.com/"):
-                files[i] = file.replace("https://files.slack.com/files-pri/", public_preffix + "file/")
+# Keys of each kind accepted by /batch
+BATCH_MAX_KEYS = int(os.getenv("BATCH_MAX_KEYS", 50))
 
-    return posts
+# Rows fetched per round trip by /export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+# Smaller bodies are not worth the CPU of compressing them
+GZIP_MIN_SIZE = 1024
+
+
+class FeedEntry:
+    """A serialized page with its validators, stored in the feed cache.
+
+    The ETag is a hash of the body, so it changes on any edit, retags and
+    deletions included, and is the same in every worker. There is no
+    Last-Modified: the time an entry was built says nothing about when the
+    data changed. The gzip copy is made on first use and kept.
+    """
+
+    def __init__(self, body, next_cursor):
+        self.body = body
+        self.next_cursor = next_cursor
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzipped
+
+
+def posts_response(deps, query, cursor_of=encode_cursor, **kwargs):
+    """Run a paginated Post query and serialize it.
+
+    The body stays a plain list for existing clients, the cursor of the
+    next page, built by `cursor_of` from the last row, is returned in the
+    X-Next-Cursor header. `deps` names the feeds the response belongs to,
+    for cache invalidation. Responses carry an ETag and revalidation
+    requests get a 304 without body.
+    """
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    cached = generation = None
+    if feed_cache is not None:
+        feed_cache.listen(listen_connection)
+        generation = feed_cache.generation
+        cached = feed_cache.get(key)
+
+    if cached is None:
+        try:
+            posts = query(**kwargs)
+        except ValueError as e:
+            abort(400, str(e))
+
+        body = serialize_rows(posts)
+        next_cursor = None
+        if posts and len(posts) >= kwargs["limit"]:
+            next_cursor = cursor_of(posts[-1])
+
+        cached = FeedEntry(body, next_cursor)
+        if feed_cache is not None:
+            feed_cache.set(key, cached, deps, generation)
+
+    resp = Response(mimetype="application/json")
+    etag = cached.etag
+    if len(cached.body) >= GZIP_MIN_SIZE and request.accept_encodings["gzip"] > 0:
+        resp.set_data(cached.gzipped())
+        resp.headers["Content-Encoding"] = "gzip"
+        # Each encoding is a different representation with its own tag
+        etag += "-gz"
+    else:
+        resp.set_data(cached.body)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.set_etag(etag)
+    # Clients may keep a copy but must check it is current before using it
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+
+    if cached.next_cursor is not None:
+        resp.headers["X-Next-Cursor"] = cached.next_cursor
+    if thumbnailer is not None:
+        # Values accepted by /file/...?w=
+        resp.headers["X-Thumbnail-Widths"] = ",".join(map(str, thumbnailer.widths))
+    # 304 without a body when If-None-Match matches
+    return resp.make_conditional(request)
 
 
 @app.route("/")
@@ -27,46 +222,337 @@ def index():
 
 @app.route("/user/<userid>")
 def user(userid):
-    limit = request.args.get("limit", 50, type=int)
-    offset = request.args.get("offset", 0, type=int)
-
-    posts = Post.get_by_author(userid, limit=limit, offset=offset)
-    json_posts = [post.asdict() for post in posts]
-    json_posts = fix_links(json_posts)
-
-    return json_posts
+    return posts_response(
+        [("author", userid)], Post.get_by_author_rows, author=userid, **page_args()
+    )
 
 
 @app.route("/tag/<tag>")
 def tag(tag):
-    limit = request.args.get("limit", 50, type=int)
-    offset = request.args.get("offset", 0, type=int)
+    args = page_args()
+    args["limit"] = min(args["limit"], 100)
+    return posts_response([("tag", tag)], Post.get_by_tag_rows, tag=tag, **args)
+
+
+@app.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    if not q:
+        abort(400, "Missing search query")
+    if len(q) > 256:
+        abort(400, "Search query too long")
+
+    args = page_args()
+    args.pop("offset")
+    args["limit"] = min(args["limit"], 100)
+    # Any new or edited post can change the results, like /latests
+    return posts_response(
+        [("latests",)],
+        Post.search_rows,
+        cursor_of=encode_search_cursor,
+        q=q,
+        tag=request.args.get("tag") or None,
+        author=request.args.get("author") or None,
+        **args,
+    )
+
+
+def cache_through(chunks, writer):
+    """Yield chunks to the client while writing them into the file cache."""
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+        writer.commit()
+    finally:
+        # No-op once committed, drops the partial file if the client went away
+        writer.discard()
+
 
-    posts = Post.get_by_tag(tag, limit=limit, offset=offset)
-    json_posts = [post.asdict() for post in posts]
-    json_posts = fix_links(json_posts)
+def mirrored_file(id, filename):
+    """Path of a file in the media mirror, None if it is not mirrored."""
+    if media_store_dir is None:
+        return None
+    relative = file_path(id, filename)
+    if relative is None:
+        return None
 
-    return json_posts
+    path = os.path.join(media_store_dir, "files", relative)
+    hit = os.path.isfile(path)
+    # Served from gunicorn threads, += alone can lose increments
+    with mirror_stats_lock:
+        mirror_stats["hits" if hit else "misses"] += 1
+    return path if hit else None
+
+
+def is_slack_file(r, filename):
+    """Whether an upstream 200 is the file itself and may be cached.
+
+    Slack answers an expired token or a missing scope with its login page,
+    directly or through a redirect; caching it would serve that page as
+    the file until eviction.
+    """
+    if r.history:
+        return False
+    content_type = r.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    return content_type != "text/html" or mimetypes.guess_type(filename)[0] == "text/html"
+
+
+def fetch_original(id, filename):
+    """Path of a Slack file on disk: mirrored, or downloaded into the file cache."""
+    path = mirrored_file(id, filename) or file_cache.get(id, filename)
+    if path is not None:
+        return path
+
+    with upstream.get(f"{slack_files_url}{id}/{filename}", headers=headers, stream=True) as r:
+        if r.status_code != 200 or not is_slack_file(r, filename):
+            return None
+        length = r.headers.get("Content-Length")
+        writer = file_cache.open(id, filename, expected_size=int(length) if length else None)
+        if writer is None:
+            return None
+        try:
+            for chunk in r.iter_content(PROXY_CHUNK_SIZE):
+                writer.write(chunk)
+            writer.commit()
+        finally:
+            writer.discard()
+    return file_cache.get(id, filename)
+
+
+# Resized copies for ?w=, they live in the file cache so they need it enabled
+thumbnailer = None
+if file_cache is not None:
+    thumbnailer = Thumbnailer(
+        file_cache,
+        fetch_original,
+        widths=[
+            int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "160,320,640,1280").split(",") if w
+        ],
+        workers=int(os.getenv("THUMBNAIL_WORKERS", 2)),
+    )
+    if not thumbnailer.enabled:
+        thumbnailer = None
 
 
 @app.route("/file/<id>/<filename>")
 def file_proxy(id, filename):
-    url = f"https://files.slack.com/files-pri/{id}/{filename}"
+    width = request.args.get("w", type=int)
+    if width and thumbnailer is not None and thumbnailer.can_resize(filename):
+        width = thumbnailer.resolve_width(width)
+        fmt = request.args.get("format", "webp")
+        if width is not None and fmt in FORMATS:
+            path = thumbnailer.get(id, filename, width, fmt)
+            if path is not None:
+                return send_file(
+                    path, mimetype=f"image/{fmt}", conditional=True, max_age=86400
+                )
+        # Larger than every derivative or rendering failed: serve the original
+
+    path = mirrored_file(id, filename)
+    if path is None and file_cache is not None:
+        path = file_cache.get(id, filename)
+    if path is not None:
+        # send_file handles Range itself and lets the server use sendfile()
+        return send_file(
+            path,
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            conditional=True,
+            max_age=86400,
+        )
+
+    url = f"{slack_files_url}{id}/{filename}"
+
+    upstream_headers = dict(headers)
+    for name in PROXY_REQUEST_HEADERS:
+        if name in request.headers:
+            upstream_headers[name] = request.headers[name]
 
-    r = requests.get(url, headers=headers)
-    resp = Response(r.content, mimetype=r.headers["content-type"])
+    try:
+        r = upstream.get(url, headers=upstream_headers, stream=True)
+    except requests.RequestException:
+        return Response("Unable to reach Slack", status=502, mimetype="text/plain")
+
+    chunks = r.raw.stream(PROXY_CHUNK_SIZE, decode_content=False)
+
+    # Only whole, unencoded bodies are worth keeping
+    if (
+        file_cache is not None
+        and r.status_code == 200
+        and is_slack_file(r, filename)
+        and "Range" not in request.headers
+        and "Content-Encoding" not in r.headers
+    ):
+        length = r.headers.get("Content-Length")
+        writer = file_cache.open(
+            id, filename, expected_size=int(length) if length else None
+        )
+        if writer is not None:
+            chunks = cache_through(chunks, writer)
+
+    resp = Response(
+        chunks,
+        status=r.status_code,
+        content_type=r.headers.get("content-type"),
+        direct_passthrough=True,
+    )
+    for name in PROXY_RESPONSE_HEADERS:
+        if name in r.headers:
+            resp.headers[name] = r.headers[name]
+
+    # Release the upstream connection even if the client goes away mid-stream
+    resp.call_on_close(r.close)
     return resp
 
 
-@app.route("/latests")
-def latests():
-    limit = request.args.get("limit", 50, type=int)
+def collect_stats():
+    stats = {"upstream": upstream.stats()}
+    if file_cache is not None:
+        stats["cache"] = {
+            "hits": file_cache.hits,
+            "misses": file_cache.misses,
+            "evictions": file_cache.evictions,
+            "bytes": file_cache.size,
+            "max_bytes": file_cache.max_bytes,
+        }
+    if media_store_dir is not None:
+        with mirror_stats_lock:
+            stats["mirror"] = dict(mirror_stats)
+    if thumbnailer is not None:
+        stats["thumbnails"] = {
+            "rendered": thumbnailer.rendered,
+            "failed": thumbnailer.failed,
+        }
+    if feed_cache is not None:
+        stats["feeds"] = {
+            "entries": len(feed_cache),
+            "hits": feed_cache.hits,
+            "misses": feed_cache.misses,
+            "invalidations": feed_cache.invalidations,
+        }
+    return stats
+
+
+metrics.register_stats(collect_stats)
+
+
+@app.route("/stats/proxy")
+def proxy_stats():
+    return collect_stats()
+
 
-    posts = Post.get_latests(limit=limit)
-    json_posts = [post.asdict() for post in posts]
-    json_posts = fix_links(json_posts)
+@app.route("/metrics")
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
-    return json_posts
+
+@app.route("/stats/tags")
+def tag_stats():
+    # Negative values would reach SQL and fail there
+    limit = max(1, min(request.args.get("limit", 50, type=int), 100))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    return {
+        "tags": [
+            {"tag": tag, "posts": posts} for tag, posts in TagStat.top(limit, offset)
+        ]
+    }
+
+
+@app.route("/stats/users/<userid>")
+def user_stats(userid):
+    return {
+        "user": userid,
+        "posts": AuthorStat.posts_of(userid),
+        "tags": [
+            {"tag": tag, "posts": posts} for tag, posts in AuthorTagStat.top(userid)
+        ],
+    }
+
+
+def key_list(name):
+    """Comma-separated values of query argument `name`, deduplicated in order."""
+    keys = list(dict.fromkeys(key for key in request.args.get(name, "").split(",") if key))
+    if len(keys) > BATCH_MAX_KEYS:
+        abort(400, f"At most {BATCH_MAX_KEYS} {name} per request")
+    return keys
+
+
+def group_rows(keys, rows):
+    """{key: [post, ...]} from rows with a trailing `key` column, every key present."""
+    groups = {key: [] for key in keys}
+    for row in rows:
+        groups[row.key].append(post_dict(*row))
+    return groups
+
+
+@app.route("/batch")
+def batch():
+    """Several feeds and posts in one response.
+
+    `users` and `tags` are comma-separated lists, each gets its newest
+    `limit` posts like /user and /tag; `ids` fetches posts by message id.
+    Each kind is one query whatever the number of keys.
+    """
+    users, tags, ids = key_list("users"), key_list("tags"), key_list("ids")
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+
+    body = {}
+    if users:
+        body["users"] = group_rows(users, Post.get_by_authors_rows(users, limit))
+    if tags:
+        body["tags"] = group_rows(tags, Post.get_by_tags_rows(tags, limit))
+    if ids:
+        # Unknown ids are left out
+        body["posts"] = {row.message_id: post_dict(*row) for row in Post.get_by_ids_rows(ids)}
+    return Response(dumps(body), mimetype="application/json")
+
+
+@app.route("/export")
+def export():
+    """Every post matching the filters, oldest first, as newline-delimited JSON.
+
+    `since` (inclusive) and `until` (exclusive) are unix timestamps. The
+    body is streamed from a server-side cursor, so a full dump is one
+    request and one query however many posts there are.
+    """
+    filters = {}
+    for name in ("since", "until"):
+        value = request.args.get(name)
+        if value:
+            try:
+                filters[name] = datetime.fromtimestamp(int(value), timezone.utc)
+            except (ValueError, OverflowError, OSError):
+                abort(400, f"Invalid {name}: {value!r}")
+
+    batches = Post.export_rows(
+        tag=request.args.get("tag") or None,
+        author=request.args.get("author") or None,
+        batch_size=EXPORT_BATCH_SIZE,
+        **filters,
+    )
+
+    def generate():
+        for rows in batches:
+            lines = []
+            for row in rows:
+                post = post_dict(*row)
+                post["author"] = row.author
+                lines.append(dumps(post))
+            lines.append(b"")
+            yield b"\n".join(lines)
+
+    resp = Response(generate(), mimetype="application/x-ndjson")
+    # Closes the cursor and hands the connection back if the client goes away
+    resp.call_on_close(batches.close)
+    return resp
+
+
+@app.route("/latests")
+def latests():
+    args = page_args()
+    args.pop("offset")
+    return posts_response([("latests",)], Post.get_latests_rows, **args)
 
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,147 @@
+"""Prometheus metrics of the API, served by main.py on /metrics.
+
+Histograms cost a few microseconds per observation, cheap enough to
+stay on in production. Under gunicorn with several worker processes,
+set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them.
+"""
+import logging
+import os
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 1 ms to 10 s
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Anything else is reported as OTHER, to keep the label set small
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "SET"}
+
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds",
+    "Time to build a response, until the first byte for streamed files",
+    ["route", "method", "status"],
+    buckets=BUCKETS,
+)
+REQUEST_DB_DURATION = Histogram(
+    "api_request_db_seconds",
+    "SQL time spent while handling a request",
+    ["route"],
+    buckets=BUCKETS,
+)
+QUERY_DURATION = Histogram(
+    "api_db_query_duration_seconds", "Duration of SQL statements", ["operation"], buckets=BUCKETS
+)
+SLOW_QUERIES = Counter("api_db_slow_queries_total", "SQL statements slower than DB_SLOW_QUERY_MS")
+UPSTREAM_DURATION = Histogram(
+    "api_upstream_request_duration_seconds",
+    "Time until Slack sent the response headers",
+    buckets=BUCKETS,
+)
+UPSTREAM_RESPONSES = Counter(
+    "api_upstream_responses_total", "Responses from Slack, by status code", ["status"]
+)
+UPSTREAM_ERRORS = Counter(
+    "api_upstream_errors_total", "Requests to Slack that got no response", ["error"]
+)
+
+
+def init_app(app):
+    """Time every request, labelled with its route rule rather than its path."""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_db_time = 0.0
+
+    @app.after_request
+    def record(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            REQUEST_DURATION.labels(route, request.method, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+            REQUEST_DB_DURATION.labels(route).observe(g.pop("metrics_db_time", 0.0))
+        return response
+
+
+def instrument_engine(engine, slow_query_ms=200):
+    """Time every statement run by `engine` and log the slow ones."""
+    slow = slow_query_ms / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+
+        operation = statement.split(None, 1)[0].upper() if statement else ""
+        QUERY_DURATION.labels(operation if operation in SQL_OPERATIONS else "OTHER").observe(elapsed)
+        if has_request_context() and "metrics_db_time" in g:
+            g.metrics_db_time += elapsed
+        if elapsed >= slow:
+            SLOW_QUERIES.inc()
+            logger.warning("Slow query (%.0f ms): %s", elapsed * 1e3, " ".join(statement.split())[:1000])
+
+
+class StatsCollector:
+    """Exposes the counters of /stats/proxy as gauges, read at scrape time."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def describe(self):
+        # Names depend on which caches are enabled, only known at scrape time
+        return []
+
+    def collect(self):
+        for section, values in self.stats().items():
+            for name, value in values.items():
+                yield GaugeMetricFamily(
+                    f"api_{section}_{name}", f"{name} of {section}, see /stats/proxy", value=value
+                )
+
+
+_stats_collectors = []
+
+
+def register_stats(stats):
+    collector = StatsCollector(stats)
+    _stats_collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def render():
+    """(body, content type) of the /metrics response.
+
+    In multiprocess mode the histograms and counters are summed over every
+    worker, while the gauges of register_stats() are those of the worker
+    answering the scrape: caches and pools are per process.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _stats_collectors:
+            registry.register(collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
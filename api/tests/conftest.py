@@ -0,0 +1,56 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The API modules are imported flat, as main.py does
+sys.path.insert(0, os.path.join(HERE, ".."))
+# Local stand-in for files.slack.com
+sys.path.insert(0, os.path.join(HERE, "..", "..", "benchmarks"))
+
+import fake_slack  # noqa: E402
+
+# database.py builds its URL at import; nothing connects until a query runs
+for name, default in (("DB_HOST", "localhost"), ("DB_PORT", "5432"), ("DB_NAME", "scrappy")):
+    os.environ.setdefault(name, default)
+
+
+@pytest.fixture(scope="session")
+def slack_files():
+    server = fake_slack.start()
+    yield f"http://127.0.0.1:{server.server_port}/files-pri/"
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def api(slack_files, tmp_path_factory):
+    """main.py configured against the fake Slack, imported once per session."""
+    os.environ.update(
+        SLACK_FILES_URL=slack_files,
+        FILE_CACHE_DIR=str(tmp_path_factory.mktemp("cache")),
+        MEDIA_STORE_DIR=str(tmp_path_factory.mktemp("media")),
+        FEED_CACHE_TTL="0",
+        UPSTREAM_RETRIES="0",
+    )
+    return importlib.import_module("main")
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+
+@pytest.fixture(scope="session")
+def database(api):
+    """Skips tests that read posts when the Postgres of .env is unreachable."""
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    try:
+        with api.engine.connect() as conn:
+            conn.execute(text("SELECT 1 FROM posts LIMIT 1"))
+    except OperationalError as e:
+        pytest.skip(f"Postgres is unreachable: {e.orig}")
+    return api
@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.mark.parametrize("kind", ["users", "tags", "ids"])
+def test_too_many_keys_is_a_400(api, client, monkeypatch, kind):
+    monkeypatch.setattr(api, "BATCH_MAX_KEYS", 2)
+
+    r = client.get(f"/batch?{kind}=a,b,c")
+    assert r.status_code == 400
+    assert f"At most 2 {kind}" in r.get_data(as_text=True)
+
+
+def test_duplicate_and_empty_keys_do_not_count(api, client, monkeypatch):
+    monkeypatch.setattr(api, "BATCH_MAX_KEYS", 2)
+    calls = []
+    monkeypatch.setattr(
+        api.Post, "get_by_authors_rows", classmethod(lambda cls, users, limit: calls.append((users, limit)) or [])
+    )
+
+    r = client.get("/batch?users=a,,b,a,b&limit=-3")
+    assert r.status_code == 200
+    assert r.json == {"users": {"a": [], "b": []}}
+    assert calls == [(["a", "b"], 1)]
+
+
+def test_no_keys_is_an_empty_object(client):
+    r = client.get("/batch")
+    assert r.status_code == 200
+    assert r.json == {}
+
+
+def test_batch_reads_every_kind(database, client):
+    r = client.get("/batch?users=UNOBODY&tags=python&ids=nope")
+    assert r.status_code == 200
+    assert r.json["users"] == {"UNOBODY": []}
+    assert r.json["posts"] == {}
@@ -0,0 +1,93 @@
+import base64
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+
+def b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+TAMPERED = [
+    "nope",
+    "!!!!",
+    "é",
+    b64(b"no separator"),
+    b64(b"not a date|msg"),
+    b64(b"\xff\xfe|msg"),
+    # Out of range once converted to UTC
+    b64(b"9999-12-31T23:59:59-23:59|msg"),
+]
+
+
+def test_cursor_round_trip(api):
+    from database import decode_cursor, encode_cursor
+
+    post = SimpleNamespace(timestamp=datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc), message_id="a|b")
+    cursor = encode_cursor(post)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (post.timestamp, "a|b")
+
+
+def test_search_cursor_round_trip(api):
+    from database import decode_search_cursor, encode_search_cursor
+
+    row = SimpleNamespace(rank=0.1 + 0.2, timestamp=datetime(2024, 5, 1, tzinfo=timezone.utc), message_id="m1")
+    assert decode_search_cursor(encode_search_cursor(row)) == (row.rank, row.timestamp, "m1")
+
+
+@pytest.mark.parametrize("cursor", TAMPERED)
+def test_malformed_cursor_raises_value_error(api, cursor):
+    from database import decode_cursor
+
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("cursor", TAMPERED)
+def test_malformed_search_cursor_raises_value_error(api, cursor):
+    from database import decode_search_cursor
+
+    with pytest.raises(ValueError):
+        decode_search_cursor(cursor)
+
+
+def test_cursor_timestamps_are_decoded_in_utc(api):
+    from database import decode_cursor
+
+    timestamp, _ = decode_cursor(b64(b"2024-01-01T20:00:00+23:00|msg"))
+    assert timestamp == datetime(2023, 12, 31, 21, tzinfo=timezone.utc)
+    assert timestamp.utcoffset().total_seconds() == 0
+
+
+@pytest.mark.parametrize("path", ["/latests", "/user/U1", "/tag/python", "/search?q=cat"])
+@pytest.mark.parametrize("cursor", TAMPERED)
+def test_malformed_cursor_is_a_400(client, path, cursor):
+    sep = "&" if "?" in path else "?"
+    r = client.get(f"{path}{sep}cursor={cursor}")
+    assert r.status_code == 400
+
+
+def test_cursor_takes_precedence_over_offset(api):
+    from database import Post, encode_cursor
+
+    cursor = encode_cursor(SimpleNamespace(timestamp=datetime(2024, 5, 1, tzinfo=timezone.utc), message_id="m1"))
+    sql = str(
+        Post._page(select(Post.message_id), 10, offset=20, cursor=cursor).compile(dialect=postgresql.dialect())
+    )
+    assert "OFFSET" not in sql
+    assert "(posts.timestamp, posts.message_id) <" in sql
+
+    sql = str(Post._page(select(Post.message_id), 10, offset=20).compile(dialect=postgresql.dialect()))
+    assert "OFFSET" in sql
+
+
+def test_offset_does_not_skip_cursor_validation(client):
+    assert client.get("/user/U1?offset=5&cursor=nope").status_code == 400
+
+
+def test_offsets_postgres_rejects_are_sent_in_utc(database, client):
+    assert client.get(f"/latests?cursor={b64(b'2024-01-01T00:00:00+23:59|msg')}").status_code == 200
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+import pytest
+
+
+@pytest.mark.parametrize("query", ["since=yesterday", "until=1.5", "since=99999999999999999999", "until=-99999999999999"])
+def test_invalid_bounds_are_a_400(client, query):
+    r = client.get(f"/export?{query}")
+    assert r.status_code == 400
+    assert "Invalid" in r.get_data(as_text=True)
+
+
+def test_bounds_are_unix_timestamps_in_utc(api, client, monkeypatch):
+    calls = []
+
+    def export_rows(cls, **kwargs):
+        calls.append(kwargs)
+        yield from ()
+
+    monkeypatch.setattr(api.Post, "export_rows", classmethod(export_rows))
+
+    r = client.get("/export?since=0&until=1700000000&tag=python&author=")
+    assert r.status_code == 200
+    assert r.data == b""
+    assert calls == [
+        {
+            "since": datetime(1970, 1, 1, tzinfo=timezone.utc),
+            "until": datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc),
+            "tag": "python",
+            "author": None,
+            "batch_size": api.EXPORT_BATCH_SIZE,
+        }
+    ]
+
+
+def test_export_streams_ndjson(database, client):
+    r = client.get("/export?since=0&until=1")
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
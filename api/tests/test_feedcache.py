@@ -0,0 +1,38 @@
+import json
+
+from feedcache import ChangeListener, FeedCache
+
+
+def filled_cache():
+    cache = FeedCache(ttl=60)
+    cache.set("/latests", b"latests", [("latests",)])
+    cache.set("/tag/a", b"a", [("tag", "a")])
+    cache.set("/tag/b", b"b", [("tag", "b")])
+    cache.set("/user/U1", b"u1", [("author", "U1")])
+    cache.set("/user/U2", b"u2", [("author", "U2")])
+    return cache
+
+
+def test_invalidate_evicts_only_the_feeds_of_the_change():
+    cache = filled_cache()
+    cache.invalidate(author="U1", tags=["a"])
+    assert [key for key in ("/latests", "/tag/a", "/tag/b", "/user/U1", "/user/U2") if cache.get(key)] == [
+        "/tag/b",
+        "/user/U2",
+    ]
+
+
+def test_all_tags_notification_evicts_every_tag_feed():
+    cache = filled_cache()
+    ChangeListener(cache, connect=None)._handle(json.dumps({"author": "U1", "all_tags": True}))
+    assert [key for key in ("/latests", "/tag/a", "/tag/b", "/user/U1", "/user/U2") if cache.get(key)] == [
+        "/user/U2"
+    ]
+
+
+def test_stale_generation_is_not_stored():
+    cache = FeedCache(ttl=60)
+    generation = cache.generation
+    cache.invalidate(author="U1")
+    cache.set("/user/U1", b"old", [("author", "U1")], generation)
+    assert cache.get("/user/U1") is None
@@ -0,0 +1,47 @@
+import gzip
+
+import pytest
+
+
+def test_feed_carries_a_content_etag_and_no_last_modified(database, client):
+    r = client.get("/latests?limit=5")
+    assert r.status_code == 200
+    assert r.headers["ETag"]
+    assert "Last-Modified" not in r.headers
+    assert r.headers["Cache-Control"] == "public, no-cache"
+
+    # Rebuilt from the database, same content: same tag
+    assert client.get("/latests?limit=5").headers["ETag"] == r.headers["ETag"]
+
+
+def test_matching_if_none_match_gets_an_empty_304(database, client):
+    etag = client.get("/latests?limit=5").headers["ETag"]
+    r = client.get("/latests?limit=5", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.data == b""
+    assert "X-Next-Cursor" in r.headers
+
+
+def test_if_modified_since_alone_does_not_give_a_304(database, client):
+    r = client.get("/latests?limit=5", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert r.status_code == 200
+
+
+def test_gzip_is_its_own_representation(database, client):
+    plain = client.get("/latests?limit=50")
+    zipped = client.get("/latests?limit=50", headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.headers["ETag"] != plain.headers["ETag"]
+
+    r = client.get("/latests?limit=50", headers={"If-None-Match": zipped.headers["ETag"]})
+    assert r.status_code == 200
+
+
+def test_invalid_cursor_is_a_400(database, client):
+    assert client.get("/latests?cursor=nope").status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/latests?limit=-1", "/user/U1?offset=-3", "/tag/x?limit=-2", "/search?q=cat&limit=-1"])
+def test_negative_page_arguments_are_not_an_error(database, client, path):
+    assert client.get(path).status_code == 200
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+
+def test_file_is_proxied_then_served_from_the_cache(api, client):
+    first = client.get("/file/F1/a.png")
+    assert first.status_code == 200
+    assert len(first.data) == 4096
+    assert api.file_cache.get("F1", "a.png") is not None
+
+    misses = api.upstream.stats()["requests"]
+    second = client.get("/file/F1/a.png")
+    assert second.data == first.data
+    assert api.upstream.stats()["requests"] == misses
+
+
+def test_range_requests_are_passed_through_and_not_cached(api, client):
+    r = client.get("/file/F2/b.mp4", headers={"Range": "bytes=0-99"})
+    assert r.status_code == 206
+    assert len(r.data) == 100
+    assert api.file_cache.get("F2", "b.mp4") is None
+
+
+@pytest.mark.parametrize("file_id", ["LOGIN1", "REDIRECT1"])
+def test_signin_page_is_not_cached(api, client, file_id):
+    r = client.get(f"/file/{file_id}/image.png")
+    assert b"Sign in" in r.data
+    assert api.file_cache.get(file_id, "image.png") is None
+    assert api.fetch_original(file_id, "image.png") is None
+    assert api.file_cache.get(file_id, "image.png") is None
+
+
+def test_html_files_are_still_cached(api, client):
+    r = client.get("/file/LOGIN2/page.html")
+    assert r.status_code == 200
+    # The cache entry is committed once the streamed body is read
+    assert b"Sign in" in r.data
+    assert api.file_cache.get("LOGIN2", "page.html") is not None
+
+
+def test_mirrored_files_with_percent_encoded_names_are_served_from_disk(api, client):
+    # The bot stores files under their decoded name, the one Flask passes on
+    path = os.path.join(api.media_store_dir, "files", "F9", "my photo.png")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"mirrored")
+
+    hits = api.mirror_stats["hits"]
+    r = client.get("/file/F9/my%20photo.png")
+    assert r.data == b"mirrored"
+    assert api.mirror_stats["hits"] == hits + 1
+
+
+@pytest.mark.parametrize("file_id, filename", [("..", "secret"), ("F9", ".."), ("F9", ""), ("F9", "a/b")])
+def test_unsafe_paths_are_not_looked_up(api, file_id, filename):
+    assert api.mirrored_file(file_id, filename) is None
+    assert api.file_cache.get(file_id, filename) is None
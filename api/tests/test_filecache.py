@@ -0,0 +1,42 @@
+from filecache import FileCache
+
+
+def put(cache, id_, name, data):
+    writer = cache.open(id_, name)
+    writer.write(data)
+    writer.commit()
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=250)
+    put(cache, "F1", "a", b"x" * 100)
+    put(cache, "F2", "b", b"x" * 100)
+    assert cache.get("F1", "a") is not None
+    put(cache, "F3", "c", b"x" * 100)
+
+    assert cache.get("F2", "b") is None
+    assert cache.get("F1", "a") is not None
+    assert cache.size == 200
+    assert cache.evictions == 1
+
+
+def test_discarded_writes_leave_nothing(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1000)
+    writer = cache.open("F1", "a")
+    writer.write(b"partial")
+    writer.discard()
+    assert cache.get("F1", "a") is None
+    assert list((tmp_path / "F1").iterdir()) == []
+
+
+def test_unsafe_names_are_refused(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1000)
+    assert cache.open("..", "passwd") is None
+    assert cache.get("F1", "../../etc") is None
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    put(FileCache(str(tmp_path), max_bytes=1000), "F1", "a", b"x" * 10)
+    cache = FileCache(str(tmp_path), max_bytes=1000)
+    assert cache.size == 10
+    assert cache.get("F1", "a") is not None
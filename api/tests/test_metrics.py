@@ -0,0 +1,11 @@
+def test_metrics_include_the_stats_gauges(client):
+    body = client.get("/metrics").data
+    assert b"api_upstream_requests" in body
+    assert b"api_request_duration_seconds" in body
+
+
+def test_multiprocess_metrics_keep_the_stats_gauges(client, monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    body = client.get("/metrics").data
+    assert b"api_upstream_requests" in body
+    assert b"api_cache_hits" in body
@@ -0,0 +1,24 @@
+import pytest
+
+
+@pytest.mark.parametrize("query", ["", "?q=", "?q=%20%20", "?tag=python"])
+def test_search_without_a_query_is_a_400(client, query):
+    assert client.get(f"/search{query}").status_code == 400
+
+
+def test_search_query_length_is_bounded(client):
+    assert client.get("/search?q=" + "a" * 257).status_code == 400
+
+
+def test_search_passes_filters_and_caps_the_limit(api, client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api.Post, "search_rows", classmethod(lambda cls, **kwargs: calls.append(kwargs) or []))
+
+    r = client.get("/search?q=%20cat%20&tag=python&limit=1000&offset=5")
+    assert r.status_code == 200
+    assert r.json == []
+    assert calls == [{"q": "cat", "tag": "python", "author": None, "limit": 100, "cursor": None}]
+
+
+def test_search_finds_posts(database, client):
+    assert client.get("/search?q=hello").status_code == 200
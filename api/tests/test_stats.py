@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [("", (50, 0)), ("?limit=-5&offset=-10", (1, 0)), ("?limit=1000&offset=20", (100, 20))],
+)
+def test_tag_stats_arguments_are_clamped(api, client, monkeypatch, query, expected):
+    calls = []
+    monkeypatch.setattr(api.TagStat, "top", classmethod(lambda cls, limit, offset: calls.append((limit, offset)) or []))
+
+    r = client.get(f"/stats/tags{query}")
+    assert r.status_code == 200
+    assert r.json == {"tags": []}
+    assert calls == [expected]
+
+
+def test_negative_tag_stats_arguments_are_not_an_error(database, client):
+    r = client.get("/stats/tags?limit=-1&offset=-1")
+    assert r.status_code == 200
+    assert len(r.json["tags"]) <= 1
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from filecache import FileCache
+from thumbnails import Thumbnailer
+
+
+def test_get_returns_when_render_finishes_before_submit_returns(tmp_path):
+    thumbnailer = Thumbnailer(FileCache(str(tmp_path), max_bytes=1024), lambda *_: None, [320])
+    submit = thumbnailer._pool.submit
+
+    def slow_submit(*args, **kwargs):
+        future = submit(*args, **kwargs)
+        future.result()
+        return future
+
+    thumbnailer._pool.submit = slow_submit
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(thumbnailer.get("F1", "a.png", 320)), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert results == [None]
+    assert thumbnailer._pending == {}
+
+
+def test_concurrent_requests_share_one_render(tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch_source(id_, filename):
+        calls.append(id_)
+        started.set()
+        release.wait(5)
+        return None
+
+    thumbnailer = Thumbnailer(FileCache(str(tmp_path), max_bytes=1024), fetch_source, [320])
+    threads = [
+        threading.Thread(target=thumbnailer.get, args=("F1", "a.png", 320), daemon=True) for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # Let the others reach get() while the first render is still running
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert calls == ["F1"]
+    assert thumbnailer._pending == {}
@@ -0,0 +1,110 @@
+import io
+import logging
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Formats a derivative can be requested in, with Pillow's name for them
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+# Animated GIFs would lose their animation, videos cannot be resized
+RESIZABLE_TYPES = ("image/png", "image/jpeg", "image/webp")
+
+
+class Thumbnailer:
+    """Width-bounded derivatives of proxied images, stored in the FileCache.
+
+    Only the widths in `widths` are generated, a request for any other width
+    is rounded up to the next one, so clients cannot fill the disk with
+    arbitrary sizes. Rendering runs on a bounded pool and concurrent
+    requests for the same derivative wait on the same job.
+    """
+
+    def __init__(self, cache, fetch_source, widths, workers=2, quality=80):
+        self.cache = cache
+        self.fetch_source = fetch_source
+        self.widths = sorted(widths)
+        self.quality = quality
+        self.rendered = 0
+        self.failed = 0
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._lock = threading.Lock()
+        self._pending = {}  # (id, name) -> Future
+
+    @property
+    def enabled(self):
+        return Image is not None and bool(self.widths)
+
+    def resolve_width(self, width):
+        """Smallest available width >= `width`, None if larger than all of them."""
+        for available in self.widths:
+            if available >= width:
+                return available
+        return None
+
+    def can_resize(self, filename):
+        return mimetypes.guess_type(filename)[0] in RESIZABLE_TYPES
+
+    @staticmethod
+    def derivative_name(filename, width, fmt):
+        return f"{filename}.w{width}.{fmt}"
+
+    def get(self, id_, filename, width, fmt="webp"):
+        """Path of the derivative, rendering it first if needed. None on failure."""
+        name = self.derivative_name(filename, width, fmt)
+        path = self.cache.get(id_, name)
+        if path is not None:
+            return path
+
+        created = False
+        with self._lock:
+            future = self._pending.get((id_, name))
+            if future is None:
+                future = self._pool.submit(self._render, id_, filename, name, width, fmt)
+                self._pending[(id_, name)] = future
+                created = True
+        # Outside the lock: a job already finished runs _done right here
+        if created:
+            future.add_done_callback(lambda _: self._done(id_, name))
+        return future.result()
+
+    def _done(self, id_, name):
+        with self._lock:
+            self._pending.pop((id_, name), None)
+
+    def _render(self, id_, filename, name, width, fmt):
+        try:
+            source = self.fetch_source(id_, filename)
+            if source is None:
+                return None
+
+            with Image.open(source) as im:
+                # Let the JPEG decoder skip detail we are about to throw away
+                im.draft("RGB", (width, width * 8))
+                im = ImageOps.exif_transpose(im)
+                im.thumbnail((width, width * 8))
+                if fmt == "jpeg" and im.mode != "RGB":
+                    im = im.convert("RGB")
+
+                buf = io.BytesIO()
+                im.save(buf, FORMATS[fmt], quality=self.quality)
+
+            writer = self.cache.open(id_, name, expected_size=buf.tell())
+            if writer is None:
+                return None
+            writer.write(buf.getvalue())
+            writer.commit()
+            self.rendered += 1
+            return self.cache.get(id_, name)
+        except Exception:
+            self.failed += 1
+            logger.exception("Unable to render %s/%s", id_, name)
+            return None
@@ -0,0 +1,75 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_RESPONSES
+
+
+class UpstreamClient:
+    """Keep-alive HTTP client shared by every request thread.
+
+    requests.Session is not meant to be shared between threads, so each
+    thread gets its own session. They all mount the same HTTPAdapter, whose
+    urllib3 pool manager is thread-safe, so warm connections are reused
+    across threads.
+    """
+
+    def __init__(self, pool_size=20, connect_timeout=5.0, read_timeout=30.0, retries=2):
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.2,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            ),
+        )
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            r = self._session().get(url, **kwargs)
+        except requests.RequestException as e:
+            UPSTREAM_ERRORS.labels(type(e).__name__).inc()
+            raise
+        # With stream=True this is the time to the headers, not the whole body
+        UPSTREAM_DURATION.observe(time.perf_counter() - start)
+        UPSTREAM_RESPONSES.labels(str(r.status_code)).inc()
+        return r
+
+    def stats(self):
+        """Connection counters summed over every host pool."""
+        opened = requests_sent = idle = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+            # Idle slots hold None until a connection is returned to them
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+        return {
+            "pools": len(pools),
+            "connections_opened": opened,
+            "connections_idle": idle,
+            "requests": requests_sent,
+            "connections_reused": max(requests_sent - opened, 0),
+        }
@@ -0,0 +1,214 @@
+"""Throughput and latency of the API endpoints at several concurrency levels.
+
+Starts the API (threaded werkzeug server) and fake_slack.py in their own
+processes, then drives each endpoint with that many client threads for
+--duration seconds. Tags, users and files are picked from the database,
+weighted by popularity, so load the corpus first (corpus.py). The feed
+and file caches are off unless asked for, to measure the database and
+proxy paths.
+
+Usage: python benchmarks/api_load.py [--endpoints latests,tag,user,file]
+       [--concurrency 1,8,32] [--duration 10] [--json results.json]
+"""
+import argparse
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "bot"))
+
+import results  # noqa: E402
+
+
+def serve_api(port):
+    """Entry point of the API process (--serve-api)."""
+    sys.path.insert(0, os.path.join(HERE, "..", "api"))
+    from werkzeug.serving import make_server
+    from main import app
+
+    # One access log line per request would be most of the work
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def load_targets(limit=1000):
+    """(value, weight) lists of tags and authors, a sample of Slack files and
+    the most common search words."""
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.connect() as conn:
+        tags = conn.execute(
+            text("SELECT tag, posts FROM tag_stats WHERE posts > 0 ORDER BY posts DESC LIMIT :n"),
+            {"n": limit},
+        ).all()
+        authors = conn.execute(
+            text("SELECT author, posts FROM author_stats WHERE posts > 0 ORDER BY posts DESC LIMIT :n"),
+            {"n": limit},
+        ).all()
+        files = conn.execute(
+            text(
+                "SELECT ref->>'id', ref->>'name' FROM "
+                "(SELECT file_refs FROM posts ORDER BY random() LIMIT :n) p, "
+                "jsonb_array_elements(p.file_refs) ref WHERE ref->>'source' = 'slack'"
+            ),
+            {"n": limit},
+        ).all()
+        words = conn.execute(
+            text("SELECT word FROM ts_stat('SELECT search_vector FROM posts') ORDER BY nentry DESC LIMIT :n"),
+            {"n": limit},
+        ).scalars().all()
+    return tags, authors, files, words
+
+
+def weighted(pairs):
+    values = [value for value, _ in pairs]
+    weights = [weight for _, weight in pairs]
+    return lambda rng: rng.choices(values, weights)[0]
+
+
+def run_case(base_url, pick_path, concurrency, duration):
+    stop = time.monotonic() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        latencies, errors = [], 0
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                with session.get(base_url + pick_path(rng), stream=True, timeout=30) as r:
+                    for _ in r.iter_content(64 * 1024):
+                        pass
+                    if r.status_code >= 400:
+                        errors += 1
+            except requests.RequestException:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for samples, _ in outcomes for latency in samples]
+    errors = sum(errors for _, errors in outcomes)
+    metrics = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "mean_ms": sum(latencies) / len(latencies) * 1e3 if latencies else None,
+    }
+    for name, value in results.percentiles(latencies).items():
+        metrics[f"{name}_ms"] = value * 1e3 if value is not None else None
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", default="latests,tag,user,file", help="also: search, batch")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per case")
+    parser.add_argument("--limit", type=int, default=50, help="page size of the listings")
+    parser.add_argument("--api-port", type=int, default=5055)
+    parser.add_argument("--slack-port", type=int, default=8765)
+    parser.add_argument("--file-size", type=int, default=256 * 1024)
+    parser.add_argument("--slack-latency", type=float, default=20, help="milliseconds")
+    parser.add_argument("--feed-cache", action="store_true", help="keep FEED_CACHE_TTL from .env")
+    parser.add_argument("--file-cache", metavar="DIR", help="proxy through a file cache in DIR")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="write results to PATH")
+    parser.add_argument("--serve-api", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_api:
+        serve_api(args.serve_api)
+        return
+
+    tags, authors, files, words = load_targets()
+    if not (tags and authors and files):
+        sys.exit("No posts to query, load a corpus with benchmarks/corpus.py first")
+
+    pick_tag, pick_author = weighted(tags), weighted(authors)
+    pickers = {
+        "latests": lambda rng: f"/latests?limit={args.limit}",
+        "tag": lambda rng: f"/tag/{pick_tag(rng)}?limit={args.limit}",
+        "user": lambda rng: f"/user/{pick_author(rng)}?limit={args.limit}",
+        "file": lambda rng: "/file/{}/{}".format(*rng.choice(files)),
+        "search": lambda rng: f"/search?q={rng.choice(words)}&limit={args.limit}",
+        "batch": lambda rng: "/batch?users={}&limit=20".format(
+            ",".join(pick_author(rng) for _ in range(10))
+        ),
+    }
+    endpoints = args.endpoints.split(",")
+    for endpoint in endpoints:
+        if endpoint not in pickers:
+            sys.exit(f"Unknown endpoint {endpoint!r}, pick from {', '.join(pickers)}")
+
+    env = dict(
+        os.environ,
+        SLACK_FILES_URL=f"http://127.0.0.1:{args.slack_port}/files-pri/",
+        FILE_CACHE_DIR=args.file_cache or "",
+    )
+    if not args.feed_cache:
+        env["FEED_CACHE_TTL"] = "0"
+
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable, os.path.join(HERE, "fake_slack.py"),
+                "--port", str(args.slack_port),
+                "--size", str(args.file_size),
+                "--latency", str(args.slack_latency),
+            ]
+        ),
+        subprocess.Popen([sys.executable, __file__, "--serve-api", str(args.api_port)], env=env),
+    ]
+    base_url = f"http://127.0.0.1:{args.api_port}"
+    try:
+        wait_until_up(base_url + "/")
+        wait_until_up(f"http://127.0.0.1:{args.slack_port}/")
+
+        cases = {}
+        for endpoint in endpoints:
+            for concurrency in map(int, args.concurrency.split(",")):
+                metrics = run_case(base_url, pickers[endpoint], concurrency, args.duration)
+                cases[f"{endpoint}@{concurrency}"] = metrics
+                print(
+                    f"{endpoint:>8} x{concurrency:<3} {metrics['rps']:9.1f} req/s "
+                    f"p50 {metrics['p50_ms'] or 0:8.2f} ms  p95 {metrics['p95_ms'] or 0:8.2f} ms  "
+                    f"p99 {metrics['p99_ms'] or 0:8.2f} ms  errors {metrics['errors']}"
+                )
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    params = {
+        key: value for key, value in vars(args).items() if key not in ("json", "serve_api")
+    }
+    results.write(args.json, "api_load", params, cases)
+
+
+if __name__ == "__main__":
+    main()
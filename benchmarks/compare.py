@@ -0,0 +1,65 @@
+"""Compare two result files written with --json by the benchmarks.
+
+Prints every metric of every case side by side with the change in
+percent. Throughputs (*_per_s, rps) are better when higher, latencies
+(*_ms, *_us) when lower; changes beyond --threshold in the wrong direction are
+flagged, and make the exit status 1.
+
+Usage: python benchmarks/compare.py before.json after.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+
+def higher_is_better(metric):
+    return metric == "rps" or metric.endswith("_per_s")
+
+
+def lower_is_better(metric):
+    return metric.endswith(("_ms", "_us"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    if before["benchmark"] != after["benchmark"]:
+        sys.exit(f"Not the same benchmark: {before['benchmark']} and {after['benchmark']}")
+
+    print(
+        f"{before['benchmark']}: {before['environment'].get('commit')} -> "
+        f"{after['environment'].get('commit')}"
+    )
+    regressions = 0
+    for case, metrics in after["results"].items():
+        old_metrics = before["results"].get(case)
+        if old_metrics is None:
+            print(f"{case}: new case")
+            continue
+        for metric, new in metrics.items():
+            old = old_metrics.get(metric)
+            if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (new - old) / old * 100
+            worse = (higher_is_better(metric) and change < -args.threshold) or (
+                lower_is_better(metric) and change > args.threshold
+            )
+            regressions += worse
+            print(
+                f"{case:>20} {metric:>16}: {old:12.2f} -> {new:12.2f} "
+                f"{change:+7.1f}%{'  REGRESSION' if worse else ''}"
+            )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Load a synthetic corpus of posts into the database configured in bot/.env.
+
+Authors and tags follow Zipf distributions, like real channels where a
+few people and tags account for most posts. Posts are written with COPY
+in chunks and get "bench-" message ids, --drop removes them.
+
+Usage: python benchmarks/corpus.py [--posts 100000] [--authors 2000] [--tags 500]
+"""
+import argparse
+import bisect
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from sqlalchemy import text  # noqa: E402
+from database import engine, init_db, file_ref, _pg_array  # noqa: E402
+
+PREFIX = "bench-"
+FILE_TYPES = [("png", 0.55), ("jpg", 0.3), ("mp4", 0.1), ("gif", 0.05)]
+
+
+class Zipf:
+    """Samples 0..n-1, value k with a weight of 1 / (k + 1) ** s."""
+
+    def __init__(self, n, s=1.1):
+        self.cum = list(itertools.accumulate(1 / (k + 1) ** s for k in range(n)))
+
+    def sample(self, rng):
+        return bisect.bisect(self.cum, rng.random() * self.cum[-1])
+
+
+class Corpus:
+    """Deterministic synthetic posts, the same seed gives the same posts."""
+
+    def __init__(self, posts, authors=2000, tags=500, days=365, seed=1):
+        self.posts = posts
+        self.rng = random.Random(seed)
+        self.authors = [f"UB{i:07d}" for i in range(authors)]
+        self.tags = [self._word(3, 10) for _ in range(tags)]
+        self.words = [self._word(2, 9) for _ in range(5000)]
+        self.author_dist = Zipf(authors)
+        self.tag_dist = Zipf(tags)
+        self.word_dist = Zipf(len(self.words), s=1.0)
+        self.start = datetime.now(timezone.utc) - timedelta(days=days)
+        # Evenly spread, so (author, timestamp) stays unique
+        self.step = timedelta(days=days) / max(posts, 1)
+
+    def _word(self, low, high):
+        return "".join(self.rng.choices(string.ascii_lowercase, k=self.rng.randint(low, high)))
+
+    def post(self, i, prefix=PREFIX):
+        rng = self.rng
+        # Most posts have 1-2 tags, a few have many
+        tags = list(
+            dict.fromkeys(
+                self.tags[self.tag_dist.sample(rng)] for _ in range(min(int(rng.expovariate(0.6)), 8))
+            )
+        )
+        files = []
+        for n in range(1 + int(rng.expovariate(1.5))):
+            ext = rng.choices([t for t, _ in FILE_TYPES], [w for _, w in FILE_TYPES])[0]
+            files.append(f"https://files.slack.com/files-pri/TBENCH-F{i:09d}{n}/file{n}.{ext}")
+        return {
+            "message_id": f"{prefix}{i}",
+            "message": " ".join(
+                self.words[self.word_dist.sample(rng)] for _ in range(rng.randint(3, 40))
+            ),
+            "author": self.authors[self.author_dist.sample(rng)],
+            "timestamp": self.start + self.step * i,
+            "tags": tags,
+            "files": files,
+            "file_refs": [file_ref(url) for url in files],
+        }
+
+    def chunks(self, size):
+        for first in range(0, self.posts, size):
+            yield [self.post(i) for i in range(first, min(first + size, self.posts))]
+
+
+def copy_posts(posts):
+    """COPY straight into posts, like Post._copy_insert minus the conflict handling."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=csv.QUOTE_ALL)
+    for row in posts:
+        writer.writerow(
+            [
+                row["message_id"],
+                row["message"],
+                row["author"],
+                row["timestamp"].isoformat(),
+                _pg_array(row["tags"]),
+                _pg_array(row["files"]),
+                json.dumps(row["file_refs"]),
+            ]
+        )
+    buf.seek(0)
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY posts (message_id, message, author, timestamp, tags, files, file_refs) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buf,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop():
+    with engine.begin() as conn:
+        return conn.execute(text("DELETE FROM posts WHERE message_id LIKE :p"), {"p": PREFIX + "%"}).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--authors", type=int, default=2000)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--chunk", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drop", action="store_true", help="only remove the synthetic posts")
+    args = parser.parse_args()
+
+    init_db()
+    removed = drop()
+    if removed:
+        print(f"Removed {removed} synthetic posts")
+    if args.drop:
+        return
+
+    corpus = Corpus(args.posts, args.authors, args.tags, args.days, args.seed)
+    start = time.perf_counter()
+    done = 0
+    for chunk in corpus.chunks(args.chunk):
+        copy_posts(chunk)
+        done += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"{done}/{args.posts} posts, {done / elapsed:,.0f} posts/s", end="\r")
+    print()
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE posts"))
+
+
+if __name__ == "__main__":
+    main()
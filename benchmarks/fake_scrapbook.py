@@ -0,0 +1,85 @@
+"""Stand-in for the scrapbook API, serving GET /api/users/<username>.
+
+Each user has --posts posts (or the count set in `posts` for tests), with
+ids "<prefix><username>-<n>", one reaction and one Slack attachment. The
+body is written post by post, like a large account would arrive, and
+`cut_after` closes the connection after that many posts to mimic a
+dropped download.
+
+Usage: python benchmarks/fake_scrapbook.py [--port 8770] [--posts 1000]
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeScrapbook(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, default_posts=1000, prefix="sb-"):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.default_posts = default_posts
+        self.prefix = prefix
+        self.posts = {}  # username -> number of posts
+        self.cut_after = None
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/"
+
+    def post(self, username, n):
+        return {
+            "id": f"{self.prefix}{username}-{n}",
+            "text": f"post {n} of {username}",
+            "timestamp": 1600000000 + n * 60,
+            "reactions": [{"name": "scrappy"}],
+            "attachments": [f"https://files.slack.com/files-pri/T0-{username}{n}/image.png"],
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        if not self.path.startswith("/api/users/"):
+            self.send_error(404)
+            return
+        username = self.path[len("/api/users/"):]
+        count = self.server.posts.get(username, self.server.default_posts)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(json.dumps({"profile": {"username": username}})[:-1].encode() + b',"posts":[')
+        for n in range(count):
+            if self.server.cut_after is not None and n >= self.server.cut_after:
+                # Truncated JSON, the client sees the connection end mid-document
+                return
+            if n:
+                self.wfile.write(b",")
+            self.wfile.write(json.dumps(self.server.post(username, n)).encode())
+        self.wfile.write(b"]}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(default_posts=1000, prefix="sb-"):
+    """Serve on a free port from a background thread, returns the FakeScrapbook."""
+    server = FakeScrapbook(default_posts=default_posts, prefix=prefix)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--posts", type=int, default=1000)
+    args = parser.parse_args()
+    FakeScrapbook(args.port, args.posts).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
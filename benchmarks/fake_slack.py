@@ -0,0 +1,110 @@
+"""Stand-in for files.slack.com, serving /files-pri/<id>/<name> with Range support.
+
+Bodies are --size bytes, generated once and shared by every file, after
+an optional --latency to mimic the round trip to Slack. Like Slack with
+an expired token, file ids starting with LOGIN get the sign-in page and
+ids starting with REDIRECT a redirect to it. Tests run it in-process
+with start().
+
+Usage: python benchmarks/fake_slack.py [--port 8765] [--size 262144] [--latency 20]
+"""
+import argparse
+import mimetypes
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+SIGNIN_PAGE = b"<!DOCTYPE html><html><body>Sign in to Slack</body></html>"
+
+
+def make_handler(body, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            if self.path == "/signin":
+                self.send_page()
+                return
+            if not self.path.startswith("/files-pri/"):
+                self.send_error(404)
+                return
+            if self.path.startswith("/files-pri/LOGIN"):
+                self.send_page()
+                return
+            if self.path.startswith("/files-pri/REDIRECT"):
+                self.send_response(302)
+                self.send_header("Location", "/signin")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            status, start, end = 200, 0, len(body) - 1
+            match = RANGE.match(self.headers.get("Range", ""))
+            if match and (match[1] or match[2]):
+                if match[1]:
+                    start = int(match[1])
+                    end = min(int(match[2]), end) if match[2] else end
+                else:
+                    start = max(0, len(body) - int(match[2]))
+                if start > end:
+                    self.send_error(416)
+                    return
+                status = 206
+
+            self.send_response(status)
+            self.send_header(
+                "Content-Type", mimetypes.guess_type(self.path)[0] or "application/octet-stream"
+            )
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            self.end_headers()
+            self.wfile.write(body[start:end + 1])
+
+        def send_page(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(SIGNIN_PAGE)))
+            self.end_headers()
+            self.wfile.write(SIGNIN_PAGE)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_server(port, size, latency_ms):
+    body = (bytes(range(256)) * (size // 256 + 1))[:size]
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(body, latency_ms / 1000))
+    server.daemon_threads = True
+    return server
+
+
+def serve(port, size, latency_ms):
+    make_server(port, size, latency_ms).serve_forever()
+
+
+def start(size=4096, latency_ms=0):
+    """Serve on a free port from a background thread, returns the server (server_port, shutdown())."""
+    server = make_server(0, size, latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds")
+    args = parser.parse_args()
+    serve(args.port, args.size, args.latency)
+
+
+if __name__ == "__main__":
+    main()
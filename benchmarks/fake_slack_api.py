@@ -0,0 +1,159 @@
+"""Stand-in for the Slack Web API (slack.com/api/<method>), for the bot's tests.
+
+Point the bot at it with SLACK_API_URL=http://127.0.0.1:<port>/api/.
+Every call is recorded with its arguments. Answers are {"ok": true} by
+default, or whatever was queued with script(): an error, a 429 with
+Retry-After, a slow answer. conversations.history returns the messages
+registered in `messages`, keyed by (channel, ts). With --ratelimit
+METHOD=N, every Nth call to METHOD gets a 429.
+
+Usage: python benchmarks/fake_slack_api.py [--port 8790] [--latency 0]
+       [--ratelimit reactions.add=4]
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+DEFAULT_BODIES = {
+    "auth.test": {"url": "https://fake.slack.com/", "team_id": "T0", "user_id": "UBOT", "bot_id": "BBOT"},
+}
+
+
+class Call:
+    __slots__ = ("method", "args", "status", "started", "finished")
+
+    def __init__(self, method, args, started):
+        self.method = method
+        self.args = args
+        self.status = None
+        self.started = started
+        self.finished = None
+
+
+class FakeSlackAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, ratelimit=None):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.latency = latency
+        self.ratelimit = dict(ratelimit or {})
+        self.calls = []
+        self.messages = {}  # (channel, ts) -> message
+        self._scripts = defaultdict(deque)
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/"
+
+    def script(self, method, *answers):
+        """Queue answers for the next calls to `method`, then back to the default.
+
+        Each answer is a dict with any of: "status" (HTTP status, 200),
+        "error" (Slack error, makes "ok" false), "retry_after" (seconds),
+        "delay" (seconds before answering) and "body" (extra fields).
+        """
+        with self._lock:
+            self._scripts[method].extend(answers)
+
+    def calls_to(self, method):
+        with self._lock:
+            return [call for call in self.calls if call.method == method]
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.messages.clear()
+            self._scripts.clear()
+            self._counts.clear()
+
+    def _answer(self, method, args):
+        """(status, headers, body, delay) for one call."""
+        with self._lock:
+            self._counts[method] += 1
+            answer = self._scripts[method].popleft() if self._scripts[method] else {}
+            every = self.ratelimit.get(method)
+            if not answer and every and self._counts[method] % every == 0:
+                answer = {"status": 429, "retry_after": 1}
+
+        status = answer.get("status", 200)
+        error = answer.get("error") or ("ratelimited" if status == 429 else None)
+        headers = {}
+        if "retry_after" in answer:
+            headers["Retry-After"] = str(answer["retry_after"])
+
+        body = {"ok": error is None}
+        if error is not None:
+            body["error"] = error
+        else:
+            body.update(DEFAULT_BODIES.get(method, {}))
+            if method == "conversations.history":
+                message = self.messages.get((args.get("channel"), args.get("latest")))
+                body["messages"] = [message] if message is not None else []
+        body.update(answer.get("body", {}))
+        return status, headers, body, answer.get("delay", 0.0)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            args = json.loads(raw or "{}")
+        else:
+            args = dict(parse_qsl(raw))
+
+        call = Call(method, args, time.monotonic())
+        with self.server._lock:
+            self.server.calls.append(call)
+        status, headers, body, delay = self.server._answer(method, args)
+        if self.server.latency or delay:
+            time.sleep(self.server.latency + delay)
+
+        data = json.dumps(body).encode()
+        call.status = status
+        call.finished = time.monotonic()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(latency=0.0, ratelimit=None):
+    """Serve on a free port from a background thread, returns the FakeSlackAPI."""
+    server = FakeSlackAPI(latency=latency, ratelimit=ratelimit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds")
+    parser.add_argument("--ratelimit", action="append", default=[], metavar="METHOD=N")
+    args = parser.parse_args()
+
+    ratelimit = {}
+    for value in args.ratelimit:
+        method, _, every = value.partition("=")
+        ratelimit[method] = int(every)
+    FakeSlackAPI(args.port, args.latency / 1000, ratelimit).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Bot ingest throughput: Post.save one by one, save_batch with a
+multi-row INSERT, and save_batch through COPY.
+
+Writes synthetic posts to the database configured in bot/.env and
+deletes them afterwards. Half of each run is then written again, to
+time the "already posted" path as well.
+
+Usage: python benchmarks/ingest.py [--posts 5000] [--batch 200] [--json results.json]
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "bot"))
+
+import results  # noqa: E402
+from corpus import Corpus  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from database import COPY_THRESHOLD, Post, init_db, session  # noqa: E402
+
+PREFIX = "bench-ingest-"
+
+
+def make_posts(corpus, first, count):
+    return [Post(**corpus.post(i, prefix=PREFIX)) for i in range(first, first + count)]
+
+
+def save_each(posts):
+    return sum(post.save() for post in posts)
+
+
+def save_batches(size):
+    def run(posts):
+        return sum(Post.save_batch(posts[i:i + size]) for i in range(0, len(posts), size))
+
+    return run
+
+
+def cleanup():
+    session.execute(text("DELETE FROM posts WHERE message_id LIKE :p"), {"p": PREFIX + "%"})
+    session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=5000, help="posts per method")
+    parser.add_argument("--batch", type=int, default=200, help="save_batch size below COPY_THRESHOLD")
+    parser.add_argument("--copy-batch", type=int, default=max(COPY_THRESHOLD, 5000))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="write results to PATH")
+    args = parser.parse_args()
+
+    init_db()
+    cleanup()
+    corpus = Corpus(args.posts * 3, seed=args.seed)
+    methods = {
+        "save": save_each,
+        "save_batch": save_batches(min(args.batch, COPY_THRESHOLD - 1)),
+        "save_batch_copy": save_batches(args.copy_batch),
+    }
+
+    cases = {}
+    try:
+        for n, (name, method) in enumerate(methods.items()):
+            posts = make_posts(corpus, n * args.posts, args.posts)
+            start = time.perf_counter()
+            inserted = method(posts)
+            elapsed = time.perf_counter() - start
+
+            duplicates = make_posts(corpus, n * args.posts, args.posts // 2)
+            start = time.perf_counter()
+            method(duplicates)
+            duplicate_elapsed = time.perf_counter() - start
+
+            cases[name] = {
+                "posts": len(posts),
+                "inserted": inserted,
+                "posts_per_s": len(posts) / elapsed,
+                "duplicates_per_s": len(duplicates) / duplicate_elapsed if duplicates else None,
+            }
+            print(
+                f"{name:>16}: {cases[name]['posts_per_s']:10,.0f} posts/s "
+                f"({inserted} inserted), duplicates {cases[name]['duplicates_per_s'] or 0:10,.0f} posts/s"
+            )
+    finally:
+        cleanup()
+
+    results.write(args.json, "ingest", {k: v for k, v in vars(args).items() if k != "json"}, cases)
+
+
+if __name__ == "__main__":
+    main()
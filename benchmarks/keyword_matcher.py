@@ -0,0 +1,82 @@
+"""Auto-tagging cost: the old per-keyword substring loop against
+KeywordMatcher's single scan.
+
+Usage: python benchmarks/keyword_matcher.py [--keywords 3000] [--messages 2000] [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from keywords import KeywordMatcher  # noqa: E402
+import results as result_file  # noqa: E402
+
+
+def random_word(rng, low, high):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(low, high)))
+
+
+def old_loop(kv, message):
+    # add_reactions before KeywordMatcher, minus the Slack calls
+    return [keyword for keyword in kv if keyword in message]
+
+
+def bench(fn, messages):
+    start = time.perf_counter()
+    for message in messages:
+        fn(message)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keywords", type=int, default=3000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=40, help="words per message")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="write results to PATH")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    kv = {random_word(rng, 2, 12): random_word(rng, 3, 8) for _ in range(args.keywords)}
+    keys = list(kv)
+    messages = [
+        " ".join(
+            rng.choice(keys) if rng.random() < 0.05 else random_word(rng, 1, 10)
+            for _ in range(args.words)
+        )
+        for _ in range(args.messages)
+    ]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"kv": kv, "blacklist": []}, f)
+    try:
+        matcher = KeywordMatcher(f.name)
+        results = {
+            "loop": bench(lambda m: old_loop(kv, m), messages),
+            "matcher": bench(matcher.match, messages),
+        }
+    finally:
+        os.unlink(f.name)
+
+    for name, per_message in results.items():
+        print(f"{name:>7}: {per_message * 1e6:10.1f} us/message")
+    print(f"speedup: {results['loop'] / results['matcher']:.1f}x")
+
+    result_file.write(
+        args.json,
+        "keyword_matcher",
+        {k: v for k, v in vars(args).items() if k != "json"},
+        {name: {"message_us": per_message * 1e6} for name, per_message in results.items()},
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""JSON result files shared by the benchmarks, compared with compare.py."""
+import json
+import platform
+import subprocess
+import time
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write(path, benchmark, params, results):
+    """`results` maps a case name ("latests@8", "save_batch", ...) to its metrics."""
+    if not path:
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "benchmark": benchmark,
+                "environment": environment(),
+                "params": params,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points
+    }
@@ -0,0 +1,99 @@
+"""Per-row cost of the listing read path: the original ORM + asdict() +
+fix_links(), kept here for comparison, against Core rows + serialize_rows().
+
+Runs against the database configured in api/.env, which needs at least
+--limit posts. Usage: python benchmarks/serialize_posts.py [--limit 100] [--json results.json]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+# Importing main must not create a file cache in the working directory
+os.environ.setdefault("FILE_CACHE_DIR", "")
+
+from main import app, public_preffix, serialize_rows  # noqa: E402
+from database import Post, session  # noqa: E402
+import results as result_file  # noqa: E402
+
+
+def asdict(post):
+    return {
+        "content": post.message,
+        "message_id": post.message_id,
+        "tags": post.tags,
+        "timestamp": int(post.timestamp.timestamp()),
+        "files": post.files,
+    }
+
+
+def fix_links(posts):
+    for post in posts:
+        files = post.get("files", [])
+        for i, file in enumerate(files):
+            if file.startswith("https://files.slack.com/"):
+                files[i] = file.replace("https://files.slack.com/files-pri/", public_preffix + "file/")
+
+    return posts
+
+
+def orm_path(limit):
+    posts = (
+        session.query(Post).order_by(Post.timestamp.desc(), Post.message_id.desc()).limit(limit).all()
+    )
+    return app.json.dumps(fix_links([asdict(post) for post in posts]))
+
+
+def rows_path(limit):
+    return serialize_rows(Post.get_latests_rows(limit=limit))
+
+
+def bench(fn, limit, repeat):
+    fn(limit)  # warm up connection and statement caches
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(limit)
+        # A fresh session per iteration, like a fresh request
+        session.remove()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", metavar="PATH", help="write results to PATH")
+    args = parser.parse_args()
+
+    with app.app_context():
+        rows = len(Post.get_latests_rows(limit=args.limit))
+        if rows < args.limit:
+            sys.exit(f"Only {rows} posts in the database, need {args.limit}")
+
+        results = {
+            "orm": bench(orm_path, args.limit, args.repeat),
+            "rows": bench(rows_path, args.limit, args.repeat),
+        }
+
+    for name, per_page in results.items():
+        print(
+            f"{name:>5}: {per_page * 1e3:8.3f} ms/page "
+            f"{per_page / args.limit * 1e6:8.2f} us/row"
+        )
+    print(f"speedup: {results['orm'] / results['rows']:.2f}x")
+
+    result_file.write(
+        args.json,
+        "serialize_posts",
+        {"limit": args.limit, "repeat": args.repeat},
+        {
+            name: {"page_ms": per_page * 1e3, "row_us": per_page / args.limit * 1e6}
+            for name, per_page in results.items()
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
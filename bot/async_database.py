@@ -0,0 +1,86 @@
+"""asyncio counterparts of the Post methods used by async_main.py.
+
+They go through asyncpg and reuse the statements and tables defined in
+database.py, so both modes write the same rows and send the same NOTIFYs.
+"""
+import os
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from database import DATABASE_URL, Post, notify_statement
+
+async_engine = create_async_engine(
+    DATABASE_URL.replace("postgresql+psycopg2://", "postgresql+asyncpg://"),
+    echo=False,
+    pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+async def save_post(post):
+    """Post.save(): False if the post (or its author/timestamp) already exists."""
+    async with AsyncSessionLocal() as session:
+        inserted = (
+            await session.execute(
+                Post.insert_statement(post._row()).returning(Post.message_id)
+            )
+        ).first()
+        if inserted is None:
+            return False
+
+        await session.execute(notify_statement(post.author, post.tags))
+        await session.commit()
+        return True
+
+
+async def delete_post(message_id):
+    """Post.delete_by_id()"""
+    async with AsyncSessionLocal() as session:
+        deleted = (
+            await session.execute(
+                delete(Post)
+                .where(Post.message_id == message_id)
+                .returning(Post.author, Post.tags, Post.file_refs)
+            )
+        ).first()
+        if deleted is None:
+            return None
+
+        await session.execute(notify_statement(deleted.author, deleted.tags))
+        await session.commit()
+        return deleted
+
+
+async def get_posts_by_author(author, limit=50):
+    """Post.get_by_author()"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Post)
+            .filter_by(author=author)
+            .order_by(Post.timestamp.desc())
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+
+async def set_tags_batch(tags_by_id):
+    """Post.set_tags_batch()"""
+    if not tags_by_id:
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        current = (
+            await session.execute(
+                select(Post.message_id, Post.author, Post.tags).where(
+                    Post.message_id.in_(list(tags_by_id))
+                )
+            )
+        ).all()
+        for message_id, author, old_tags in current:
+            tags = tags_by_id[message_id]
+            await session.execute(
+                update(Post).where(Post.message_id == message_id).values(tags=tags)
+            )
+            await session.execute(notify_statement(author, list(old_tags or []) + list(tags)))
+        await session.commit()
+        return len(current)
@@ -0,0 +1,353 @@
+"""asyncio version of main.py, run with `python async_main.py`.
+
+Listeners ack first and do their work in lazy listeners, at most
+ASYNC_CONCURRENCY events at a time, so a burst of messages is processed
+in parallel instead of queueing behind slow Slack and database calls.
+Scrapbook imports and reaction flushes keep running on their threads.
+"""
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+from slack_sdk.errors import SlackApiError
+from slack_bolt.async_app import AsyncApp
+from functools import wraps
+from dotenv import load_dotenv
+from common import (
+    CHANNELS,
+    keyword_matcher,
+    media_files,
+    post_from_message,
+    requested_user,
+    posts_view,
+    create_reaction_coalescer,
+    create_scrapbook_importer,
+)
+from database import engine
+import metrics
+from media import MediaMirror
+from os import getenv
+import async_database as db
+import traceback
+import asyncio
+
+load_dotenv()
+app = AsyncApp()
+# Wait for Retry-After and try again when Slack answers 429
+app.client.retry_handlers.append(AsyncRateLimitErrorRetryHandler(max_retry_count=2))
+bot_id = getenv("BOT_UID", "U09VC4NQXC6")
+
+# Events processed at the same time
+concurrency = asyncio.Semaphore(int(getenv("ASYNC_CONCURRENCY", 32)))
+# Reaction calls in flight, across all events
+reaction_slots = asyncio.Semaphore(int(getenv("REACTION_WORKERS", 4)))
+
+# Copies of post files the API serves instead of asking Slack, off unless MEDIA_STORE_DIR is set
+media_mirror = MediaMirror.from_env()
+
+# Set by main(), lets the import and reaction threads call into the event loop
+loop = None
+
+
+def bounded(fn):
+    """Run a lazy listener only once a concurrency slot is free."""
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        async with concurrency:
+            return await fn(*args, **kwargs)
+
+    return wrapper
+
+
+async def ack_now(ack):
+    await ack()
+
+
+async def set_reaction(client, method, channel, ts, name, expected_errors=()):
+    """Call reactions_add/reactions_remove, ignoring errors that mean "already done"."""
+    async with reaction_slots:
+        try:
+            await getattr(client, method)(channel=channel, timestamp=ts, name=name)
+        except SlackApiError as e:
+            if e.response.get("error") not in expected_errors:
+                raise
+
+
+async def remove_reactions(shortcut, client):
+    ts = shortcut["message"]["ts"]
+    channel = shortcut["channel"]["id"]
+
+    result = await client.conversations_history(
+        channel=channel, latest=ts, inclusive=True, limit=1
+    )
+
+    message = result.get("messages", [])[0]
+    await asyncio.gather(
+        *(
+            set_reaction(
+                client, "reactions_remove", channel, ts, reaction["name"],
+                expected_errors=("no_reaction",),
+            )
+            for reaction in message.get("reactions", [])
+            if bot_id in reaction["users"]
+        )
+    )
+
+
+async def add_reactions(shortcut, client):
+    message = shortcut["message"]["text"]
+    channel = shortcut["channel"]["id"]
+    ts = shortcut["message"]["ts"]
+
+    matches = keyword_matcher.match(message)
+
+    # One call per emoji, even when several keywords map to it
+    emojis = list(dict.fromkeys(matches.values()))
+    results = await asyncio.gather(
+        *(
+            set_reaction(
+                client, "reactions_add", channel, ts, emoji,
+                expected_errors=("already_reacted",),
+            )
+            for emoji in emojis
+        ),
+        return_exceptions=True,
+    )
+    for emoji, result in zip(emojis, results):
+        if isinstance(result, Exception):
+            # A missing reaction should not prevent the post from being saved
+            app.logger.warning("Unable to add :%s: to %s: %s", emoji, ts, result)
+
+    return list(matches)
+
+
+async def process_message_post(message: dict, channel: str, client) -> tuple[bool, str]:
+    if len(media_files(message)) == 0:
+        return False, "You need to have images or videos in your post"
+
+    tags = await add_reactions({"message": message, "channel": {"id": channel}}, client)
+
+    post = post_from_message(message, tags)
+    success = await db.save_post(post)
+
+    if success:
+        if media_mirror is not None:
+            # Only queues, the downloads run on the mirror's threads
+            media_mirror.enqueue(post.file_refs)
+        return True, "Your post has been saved!"
+    else:
+        return False, "This has already been post :sadgua:"
+
+
+@bounded
+@metrics.timed("message")
+async def new_message(event, client):
+    if event.get("channel") not in CHANNELS:
+        return
+
+    if event.get("subtype") == "message_deleted":
+        msg_id = event["previous_message"]["client_msg_id"]
+        post = await db.delete_post(msg_id)
+        if post is not None and media_mirror is not None:
+            media_mirror.remove(post.file_refs)
+
+        await client.chat_postEphemeral(
+            channel=event["channel"],
+            user=event["previous_message"]["user"],
+            text=f"Your post has been deleted :agabye:",
+        )
+
+        return
+
+    if event.get("thread_ts") != None:
+        # Message sent in a thread
+        return
+
+    # Check if message has files before processing
+    if not event.get("files"):
+        await client.chat_postEphemeral(
+            channel=event["channel"],
+            user=event["user"],
+            text="You need to have images or videos in your post",
+        )
+        return
+
+    try:
+        success, msg = await process_message_post(
+            message=event, channel=event["channel"], client=client
+        )
+
+        # Show message for both success and failure
+        await client.chat_postEphemeral(
+            channel=event["channel"],
+            user=event["user"],
+            text=msg,
+        )
+    except Exception as e:
+        await client.chat_postEphemeral(
+            channel=event["channel"],
+            user=event["user"],
+            text=f"Unable to auto-post this message :sadgua:\n```{str(e)}```",
+        )
+
+
+app.event("message")(ack=ack_now, lazy=[new_message])
+
+
+def call_from_thread(method, **kwargs):
+    """Web API call from a worker thread, run on the event loop."""
+    return asyncio.run_coroutine_threadsafe(getattr(app.client, method)(**kwargs), loop).result()
+
+
+def set_tags_from_thread(tags_by_id):
+    return asyncio.run_coroutine_threadsafe(db.set_tags_batch(tags_by_id), loop).result()
+
+
+# Bursts of reactions on a message become one fetch and one tag write
+reaction_updates = create_reaction_coalescer(
+    call_from_thread, bot_id, app.logger, set_tags_batch=set_tags_from_thread
+)
+
+metrics.register_stats(coalescer=reaction_updates, mirror=media_mirror)
+# The importer still writes through the sync engine
+for instrumented in (engine, db.async_engine.sync_engine):
+    metrics.instrument_engine(instrumented, slow_query_ms=float(getenv("DB_SLOW_QUERY_MS", 200)))
+
+
+@app.event("reaction_added")
+@app.event("reaction_removed")
+@metrics.timed("reaction")
+async def handle_reaction(event):
+    if event["user"] != event["item_user"]:
+        return
+
+    reaction_updates.submit(
+        (event["item"]["channel"], event["item"]["ts"]), event["item_user"]
+    )
+
+
+@bounded
+@metrics.timed("unpost_message")
+async def handle_unpost(shortcut, client):
+    try:
+        msg_id = shortcut["message"]["client_msg_id"]
+        channel = shortcut["channel"]["id"]
+        author = shortcut["message"]["user"]
+        shortcut_author = shortcut["user"]["id"]
+
+        if author != shortcut_author:
+            await client.chat_postEphemeral(
+                channel=channel,
+                user=shortcut_author,
+                text="You can only unpost your own post :sadgua:",
+            )
+            return
+
+        await remove_reactions(shortcut, client)
+        post = await db.delete_post(msg_id)
+
+        if post is not None:
+            if media_mirror is not None:
+                media_mirror.remove(post.file_refs)
+            await client.chat_postEphemeral(
+                channel=channel,
+                user=author,
+                text="You're post have been deleted!",
+            )
+    except:
+        await client.chat_postEphemeral(
+            channel=channel,
+            user=author,
+            text=f"Unable to delete this post :sadgua:\n```{traceback.format_exc()}```",
+        )
+
+
+app.shortcut("unpost_message")(ack=ack_now, lazy=[handle_unpost])
+
+
+def notify_user(userid, text):
+    # Called on an import thread. Direct message, it still works long
+    # after the slash command expired
+    asyncio.run_coroutine_threadsafe(
+        app.client.chat_postMessage(channel=userid, text=text), loop
+    ).result()
+
+
+scrapbook_importer = create_scrapbook_importer(notify_user, media_mirror)
+
+
+@app.command("/import-scrapbook")
+@metrics.timed("/import-scrapbook")
+async def import_scrapbook(ack, respond, command):
+    await ack()
+    username = command["user_name"]
+    userid = command["user_id"]
+
+    # start() only claims the job, the import itself runs on the importer's threads
+    if await asyncio.to_thread(scrapbook_importer.start, userid, username):
+        await respond(":agabusiness: Importing your scrapbook, I'll DM you when it's done!")
+    else:
+        await respond("An import is already running for you :sadgua:")
+
+
+@app.command("/posts")
+@metrics.timed("/posts")
+async def userinfo(ack, command, client):
+    await ack()
+
+    userid = requested_user(command)
+    posts = await db.get_posts_by_author(userid, limit=5)
+
+    await client.views_open(trigger_id=command["trigger_id"], view=posts_view(userid, posts))
+
+
+@bounded
+@metrics.timed("post_message")
+async def handle_post(shortcut, client):
+    try:
+        message = shortcut["message"]
+        channel = shortcut["channel"]["id"]
+        author = message["user"]
+        shortcut_author = shortcut["user"]["id"]
+
+        if author != shortcut_author:
+            await client.chat_postEphemeral(
+                channel=channel,
+                user=shortcut_author,
+                text="You can only post your own message :sadgua:",
+            )
+            return
+
+        success, msg = await process_message_post(
+            message=message, channel=channel, client=client
+        )
+
+        await client.chat_postEphemeral(
+            channel=channel,
+            user=author,
+            text=msg,
+        )
+    except:
+        await client.chat_postEphemeral(
+            channel=channel,
+            user=author,
+            text=f"Unable to post this message :sadgua:\n```{traceback.format_exc()}```",
+        )
+
+
+app.shortcut("post_message")(ack=ack_now, lazy=[handle_post])
+
+
+async def main():
+    global loop
+    loop = asyncio.get_running_loop()
+
+    if getenv("METRICS_PORT"):
+        metrics.serve(int(getenv("METRICS_PORT")))
+
+    await asyncio.to_thread(scrapbook_importer.resume)
+    handler = AsyncSocketModeHandler(app)
+    await handler.start_async()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """Collapses bursts of events per key into a single deferred call.
+
+    A key is flushed once no new event arrived for `quiet` seconds, or at
+    the latest `max_delay` seconds after its first event so a post that
+    keeps getting reactions is still written regularly. Every key due at
+    the same time is handed to `flush` in one batch, as a {key: value}
+    dict holding the last value submitted for each key.
+    """
+
+    def __init__(self, flush, quiet=2.0, max_delay=10.0):
+        self.flush = flush
+        self.quiet = quiet
+        self.max_delay = max_delay
+
+        self.events = 0
+        self.flushed = 0
+        self.batches = 0
+
+        self._pending = {}  # key -> [first_seen, last_seen, value]
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, value=None):
+        now = time.monotonic()
+        with self._cond:
+            self.events += 1
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [now, now, value]
+            else:
+                entry[1] = now
+                entry[2] = value
+            self._cond.notify()
+
+    def _deadline(self, entry):
+        first_seen, last_seen, _ = entry
+        return min(last_seen + self.quiet, first_seen + self.max_delay)
+
+    def _take_due(self):
+        """Wait until at least one key is due, then remove and return those."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = {
+                    key: entry[2]
+                    for key, entry in self._pending.items()
+                    if self._deadline(entry) <= now
+                }
+                if due:
+                    for key in due:
+                        del self._pending[key]
+                    return due
+
+                next_deadline = min(
+                    (self._deadline(entry) for entry in self._pending.values()),
+                    default=None,
+                )
+                self._cond.wait(None if next_deadline is None else next_deadline - now)
+
+    def _run(self):
+        while True:
+            batch = self._take_due()
+            try:
+                self.flush(batch)
+            except Exception:
+                logger.exception("Unable to flush %d coalesced keys", len(batch))
+            with self._cond:
+                self.flushed += len(batch)
+                self.batches += 1
+
+    def stats(self):
+        """`coalesced` counts events absorbed into another event's flush."""
+        with self._cond:
+            return {
+                "events": self.events,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "pending": len(self._pending),
+                "coalesced": self.events - self.flushed - len(self._pending),
+            }
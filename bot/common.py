@@ -0,0 +1,194 @@
+"""Slack message helpers shared by main.py and async_main.py."""
+from datetime import datetime, timezone
+from keywords import KeywordMatcher
+from coalescer import Coalescer
+from importer import ScrapbookImporter
+from database import Post
+from os import getenv
+import metrics
+import re
+
+# Only #scrappy-doo or #scrapbook
+CHANNELS = ["C09VC37P2NA", "C01504DCLVD"]
+UNESCAPED_USER_PATTERN = r".+@(U[A-Z0-9]+).+"
+
+# load reactions or die, reloaded when the file changes
+keyword_matcher = KeywordMatcher("reactions.json")
+
+
+def get_reactions(message: dict, author_id: str, bot_id: str) -> list[str]:
+    reactions = set()
+
+    authorized = [author_id, bot_id, "U015D6A36AG"]  # scrappy
+    blacklist = {
+        name.strip(":") for name in keyword_matcher.reactions.get("blacklist", [])
+    }
+
+    for reaction in message.get("reactions", []):
+        if any(user in authorized for user in reaction["users"]) and (
+            reaction["name"] not in blacklist
+        ):
+            reactions.add(reaction["name"])
+    return list(reactions)
+
+
+def media_files(message: dict) -> list[str]:
+    """url_private of the images and videos attached to a message."""
+    files = []
+    for file in message.get("files", []):
+        if not (
+            file["mimetype"].startswith("image/")
+            or file["mimetype"].startswith("video/")
+        ):
+            continue
+        files.append(file["url_private"])
+    return files
+
+
+def create_reaction_coalescer(call, bot_id: str, logger, set_tags_batch=Post.set_tags_batch) -> Coalescer:
+    """Coalescer turning bursts of reactions on a message into one fetch and one tag write.
+
+    Its batches map (channel, ts) to the message author, as submitted by
+    the reaction handlers. `call(method, **kwargs)` makes a Web API call
+    and returns the answer, `set_tags_batch` writes the tags; both run on
+    the coalescer thread.
+    """
+
+    @metrics.timed("flush_reactions")
+    def flush_reactions(batch):
+        tags_by_id = {}
+        for (channel, ts), author in batch.items():
+            try:
+                response = call("conversations_history", channel=channel, latest=ts, inclusive=True, limit=1)
+            except Exception:
+                # Only this message misses its update, the others are still written
+                logger.exception("Unable to fetch reactions of %s in %s", ts, channel)
+                continue
+            messages = response.get("messages", [])
+            if not messages or "client_msg_id" not in messages[0]:
+                continue
+            tags_by_id[messages[0]["client_msg_id"]] = get_reactions(messages[0], author, bot_id)
+
+        updated = set_tags_batch(tags_by_id)
+        logger.info(
+            "Updated tags of %d posts, %d reaction events coalesced so far",
+            updated,
+            coalescer.stats()["coalesced"],
+        )
+
+    coalescer = Coalescer(
+        flush_reactions,
+        quiet=float(getenv("REACTION_QUIET_SECONDS", 2)),
+        max_delay=float(getenv("REACTION_MAX_DELAY", 10)),
+    )
+    return coalescer
+
+
+def create_scrapbook_importer(notify_user, media_mirror=None) -> ScrapbookImporter:
+    """Importer configured by the SCRAPBOOK_API_URL and IMPORT_* variables.
+
+    `notify_user(userid, text)` is called from the importer's threads.
+    """
+    return ScrapbookImporter(
+        notify_user,
+        base_url=getenv("SCRAPBOOK_API_URL", "https://scrapbook.hackclub.com/api/"),
+        chunk_size=int(getenv("IMPORT_CHUNK_SIZE", 500)),
+        workers=int(getenv("IMPORT_WORKERS", 2)),
+        on_saved=media_mirror.enqueue_posts if media_mirror is not None else None,
+    )
+
+
+def post_from_message(message: dict, tags: list[str]) -> Post:
+    return Post(
+        message_id=message["client_msg_id"],
+        author=message["user"],
+        message=message["text"],
+        timestamp=datetime.fromtimestamp(float(message["ts"]), tz=timezone.utc),
+        tags=tags,
+        files=media_files(message),
+    )
+
+
+def requested_user(command: dict) -> str:
+    """User mentioned in a /posts command, defaults to the caller."""
+    userid = command["user_id"]
+
+    if len(command["text"]) != 0:
+        match = re.match(UNESCAPED_USER_PATTERN, command["text"])
+        if match:
+            if match.group(1):
+                userid = match.group(1)
+
+    return userid
+
+
+def format_post_block(post):
+    ts_str = post.timestamp.strftime("%Y-%m-%d %H:%M UTC")
+    tags_str = ", ".join(post.tags) if post.tags else "No tags"
+    file_count = len(post.files) if post.files else 0
+
+    # Section with message text
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{ts_str}*\n{post.message or '_No text_'}",
+            },
+        },
+        {
+            "type": "context",
+            "elements": [
+                {"type": "mrkdwn", "text": f"Tags: `{tags_str}`"},
+                {"type": "mrkdwn", "text": f"Files: {file_count}"},
+            ],
+        },
+    ]
+
+    if post.files:
+        blocks.append(
+            {"type": "image", "image_url": post.files[0], "alt_text": "attachment"}
+        )
+
+    blocks.append({"type": "divider"})
+    return blocks
+
+
+def posts_view(userid: str, posts: list[Post]) -> dict:
+    """Modal listing `posts` for the /posts command."""
+    blocks = []
+    if posts:
+        blocks.append(
+            {
+                "type": "header",
+                "text": {"type": "plain_text", "text": "User Posts", "emoji": True},
+            }
+        )
+        blocks.append(
+            {
+                "type": "context",
+                "elements": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Showing latest {len(posts)} posts for <@{userid}>",
+                    }
+                ],
+            }
+        )
+        blocks.append({"type": "divider"})
+        for post in posts:
+            blocks.extend(format_post_block(post))
+    else:
+        blocks = [
+            {
+                "type": "section",
+                "text": {"type": "mrkdwn", "text": f"No posts found for <@{userid}>."},
+            }
+        ]
+
+    return {
+        "type": "modal",
+        "title": {"type": "plain_text", "text": "User Info"},
+        "close": {"type": "plain_text", "text": "Close"},
+        "blocks": blocks,
+    }
@@ -1,6 +1,12 @@
 import os
-from sqlalchemy import create_engine, Column, String, Text, TIMESTAMP, ARRAY, UniqueConstraint
-from sqlalchemy.orm import declarative_base, sessionmaker
+import io
+import csv
+import sys
+import json
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, Column, Computed, String, Text, TIMESTAMP, ARRAY, Integer, UniqueConstraint, Index, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, insert as pg_insert
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
 from sqlalchemy.ext.mutable import MutableList
@@ -22,7 +28,58 @@ Base = declarative_base()
 
 # Create session factory
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
-session = SessionLocal()
+# One session per thread: Bolt listeners and background flushes run concurrently
+session = scoped_session(SessionLocal)
+
+# The API listens on this channel to evict cached feeds
+NOTIFY_CHANNEL = "posts_changed"
+
+
+# Postgres rejects payloads of 8000 bytes or more, and aborts the transaction with them
+NOTIFY_MAX_BYTES = 7000
+
+
+def notify_statement(author, tags):
+    """SELECT pg_notify(...) naming the feeds touched by a change.
+
+    When the tags do not fit in a payload, it carries "all_tags" instead
+    and the API evicts every tag feed, rather than failing the write.
+    """
+    payload = json.dumps({"author": author, "tags": sorted(set(tags or []))})
+    if len(payload.encode()) >= NOTIFY_MAX_BYTES:
+        payload = json.dumps({"author": author, "all_tags": True})
+    return text("SELECT pg_notify(:channel, :payload)").bindparams(
+        channel=NOTIFY_CHANNEL, payload=payload
+    )
+
+
+def notify_change(author, tags):
+    """Queue a NOTIFY naming the feeds touched by the current transaction.
+
+    Postgres only delivers it on commit, so it must run before session.commit().
+    """
+    session.execute(notify_statement(author, tags))
+
+
+SLACK_FILE_PREFIX = "https://files.slack.com/files-pri/"
+
+
+def file_ref(url):
+    """Normalized reference for a file URL, stored so readers never parse URLs.
+
+    Slack files become {"source": "slack", "id": ..., "name": ...}, the
+    path segments the API proxy needs; anything else is kept as
+    {"source": "url", "url": ...}.
+    """
+    if url.startswith(SLACK_FILE_PREFIX):
+        file_id, _, name = url[len(SLACK_FILE_PREFIX):].partition("/")
+        if file_id and name:
+            return {"source": "slack", "id": file_id, "name": name}
+    return {"source": "url", "url": url}
+
+
+# Text search configuration of posts.search_vector, the API queries with the same one
+SEARCH_CONFIG = "english"
 
 
 class Post(Base):
@@ -36,35 +93,76 @@ class Post(Base):
     )
     tags = Column(MutableList.as_mutable(ARRAY(String)), default=list)
     files = Column(MutableList.as_mutable(ARRAY(String)), default=list)
+    file_refs = Column(JSONB)
+    # Filled by Postgres from message, queried by the API's /search
+    search_vector = Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{SEARCH_CONFIG}', coalesce(message, ''))", persisted=True),
+    )
 
     __table_args__ = (
         UniqueConstraint('author', 'timestamp', name='uq_author_timestamp'),
+        # Keep in sync with the migrations below
+        Index('ix_posts_tags', 'tags', postgresql_using='gin'),
+        Index('ix_posts_author_timestamp', 'author', timestamp.desc(), message_id.desc()),
+        Index('ix_posts_timestamp', timestamp.desc(), message_id.desc()),
+        Index('ix_posts_search', 'search_vector', postgresql_using='gin'),
     )
 
+    def __init__(self, **kwargs):
+        if "files" in kwargs and "file_refs" not in kwargs:
+            kwargs["file_refs"] = [file_ref(url) for url in kwargs["files"] or []]
+        super().__init__(**kwargs)
+
+    def _row(self):
+        """Column values for a Core INSERT."""
+        return {
+            "message_id": self.message_id,
+            "message": self.message,
+            "author": self.author,
+            "timestamp": self.timestamp or datetime.now(timezone.utc),
+            "tags": list(self.tags or []),
+            "files": list(self.files or []),
+            "file_refs": self.file_refs if self.file_refs is not None else [],
+        }
+
+    @classmethod
+    def insert_statement(cls, rows):
+        """INSERT that skips rows conflicting on message_id or author/timestamp."""
+        return pg_insert(cls).values(rows).on_conflict_do_nothing()
+
     # Instance methods
     def save(self):
-        if session.query(Post).filter_by(message_id=self.message_id).first():
-            return False
-        
-        # Check for existing author-timestamp combination
-        if session.query(Post).filter_by(author=self.author, timestamp=self.timestamp).first():
+        # Skips both duplicate message ids and duplicate author/timestamp
+        # pairs atomically, in a single round trip
+        inserted = session.execute(
+            Post.insert_statement(self._row()).returning(Post.message_id)
+        ).first()
+
+        if inserted is None:
+            session.rollback()
             return False
 
-        session.add(self)
+        notify_change(self.author, self.tags)
         session.commit()
         return True
 
     def delete(self):
         session.delete(self)
+        notify_change(self.author, self.tags)
         session.commit()
 
     def set_tags(self, tags):
+        # Feeds of removed tags change as well
+        notify_change(self.author, list(self.tags or []) + list(tags))
         self.tags = tags
         session.commit()
 
     def set_files(self, files):
         """Set the files list for this post."""
         self.files = files
+        self.file_refs = [file_ref(url) for url in files]
+        notify_change(self.author, self.tags)
         session.commit()
 
     # Class methods
@@ -81,7 +179,7 @@ class Post(Base):
         limit = min(limit, 100)
         return (
             session.query(cls)
-            .filter(tag == func.any(cls.tags))
+            .filter(cls.tags.contains([tag]))
             .order_by(cls.timestamp.desc())
             .limit(limit)
             .all()
@@ -89,47 +187,428 @@ class Post(Base):
 
     @classmethod
     def delete_by_id(cls, id_):
+        """Returns the deleted post, None if there was none."""
         obj = session.query(cls).filter_by(message_id=id_).first()
         if obj:
             session.delete(obj)
+            notify_change(obj.author, obj.tags)
             session.commit()
-            return True
-        return False
+            return obj
+        return None
+
+    @classmethod
+    def set_tags_batch(cls, tags_by_id):
+        """Set the tags of several posts in one transaction. Returns the number updated."""
+        if not tags_by_id:
+            return 0
+
+        posts = session.query(cls).filter(cls.message_id.in_(list(tags_by_id))).all()
+        for post in posts:
+            tags = tags_by_id[post.message_id]
+            notify_change(post.author, list(post.tags or []) + list(tags))
+            post.tags = tags
+        session.commit()
+        return len(posts)
 
     @classmethod
     def save_batch(cls, posts):
         """Save multiple posts in a single transaction. Returns count of successfully saved posts."""
-        existing_ids = {
-            row[0] for row in session.query(cls.message_id)
-            .filter(cls.message_id.in_([p.message_id for p in posts]))
-            .all()
-        }
+        if not posts:
+            return 0
 
-        # Check for existing author-timestamp combinations
-        from sqlalchemy import tuple_
-        author_timestamp_pairs = [(p.author, p.timestamp) for p in posts]
-        existing_author_timestamps = {
-            (row[0], row[1]) for row in session.query(cls.author, cls.timestamp)
-            .filter(tuple_(cls.author, cls.timestamp).in_(author_timestamp_pairs))
-            .all()
-        }
+        rows = [p._row() for p in posts]
+        if len(rows) >= COPY_THRESHOLD:
+            inserted = cls._copy_insert(rows)
+        else:
+            inserted = session.execute(
+                cls.insert_statement(rows).returning(cls.author, cls.tags)
+            ).all()
 
-        new_posts = [
-            p for p in posts 
-            if p.message_id not in existing_ids 
-            and (p.author, p.timestamp) not in existing_author_timestamps
-        ]
+        tags_by_author = {}
+        for author, tags in inserted:
+            tags_by_author.setdefault(author, set()).update(tags or [])
+        for author, tags in tags_by_author.items():
+            notify_change(author, tags)
+        session.commit()
 
-        if new_posts:
-            session.bulk_save_objects(new_posts)
-            session.commit()
+        return len(inserted)
+
+    @classmethod
+    def _copy_insert(cls, rows):
+        """COPY rows into a temporary table, then move the new ones into posts.
+
+        Returns (author, tags) of the inserted rows. Runs in the session's
+        transaction, the staging table is dropped on commit.
+        """
+        buf = io.StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL)
+        for row in rows:
+            writer.writerow(
+                [
+                    row["message_id"],
+                    row["message"],
+                    row["author"],
+                    row["timestamp"].isoformat(),
+                    _pg_array(row["tags"]),
+                    _pg_array(row["files"]),
+                    json.dumps(row["file_refs"]),
+                ]
+            )
+        buf.seek(0)
+
+        columns = "message_id, message, author, timestamp, tags, files, file_refs"
+        session.execute(
+            text(
+                "CREATE TEMP TABLE posts_staging "
+                "(LIKE posts INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+        )
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY posts_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buf
+            )
+        finally:
+            cursor.close()
+
+        return session.execute(
+            text(
+                f"INSERT INTO posts ({columns}) "
+                f"SELECT {columns} FROM posts_staging "
+                "ON CONFLICT DO NOTHING RETURNING author, tags"
+            )
+        ).all()
+
+
+class ImportJob(Base):
+    """Progress of a /import-scrapbook run, one row per user."""
+
+    __tablename__ = "import_jobs"
+
+    user_id = Column(String(64), primary_key=True)
+    username = Column(String(128), nullable=False)
+    status = Column(String(16), nullable=False)  # running, done or failed
+    # Scrapbook posts read so far, a resumed job skips that many
+    processed = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    started_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+    @classmethod
+    def claim(cls, user_id, username):
+        """Start a fresh job for `user_id`. False if one is already running."""
+        claimed = session.execute(
+            pg_insert(cls)
+            .values(user_id=user_id, username=username, status="running")
+            .on_conflict_do_update(
+                index_elements=[cls.user_id],
+                set_={
+                    "username": username,
+                    "status": "running",
+                    "processed": 0,
+                    "imported": 0,
+                    "error": None,
+                    "started_at": func.now(),
+                    "updated_at": func.now(),
+                },
+                where=cls.status != "running",
+            )
+            .returning(cls.user_id)
+        ).first()
+        session.commit()
+        return claimed is not None
+
+    @classmethod
+    def get(cls, user_id):
+        # Worker threads keep their session, make sure it is not a stale copy
+        return session.query(cls).populate_existing().filter_by(user_id=user_id).first()
+
+    @classmethod
+    def get_running(cls):
+        return session.query(cls).filter_by(status="running").all()
+
+    def checkpoint(self, processed, imported):
+        self.processed = processed
+        self.imported = imported
+        self.updated_at = func.now()
+        session.commit()
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.updated_at = func.now()
+        session.commit()
+
+class TagStat(Base):
+    """Number of posts per tag, kept up to date by the posts_stats triggers."""
+
+    __tablename__ = "tag_stats"
 
-        return len(new_posts)
+    tag = Column(String, primary_key=True)
+    posts = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_tag_stats_posts", posts.desc(), tag),)
+
+
+class AuthorStat(Base):
+    """Number of posts per author, kept up to date by the posts_stats triggers."""
+
+    __tablename__ = "author_stats"
+
+    author = Column(String(64), primary_key=True)
+    posts = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_author_stats_posts", posts.desc(), author),)
+
+
+class AuthorTagStat(Base):
+    """Number of posts per (author, tag), kept up to date by the posts_stats triggers."""
+
+    __tablename__ = "author_tag_stats"
+
+    author = Column(String(64), primary_key=True)
+    tag = Column(String, primary_key=True)
+    posts = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_author_tag_stats_posts", author, posts.desc(), tag),)
+
+
+# save_batch switches from a multi-row INSERT to COPY from this many posts
+COPY_THRESHOLD = 500
+
+
+def _pg_array(values):
+    """Postgres array literal for a list of strings, as COPY expects it."""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'"{v}"' for v in escaped) + "}"
+
+
+def _create_index_concurrently(conn, name, ddl):
+    """Build an index without locking writes.
+
+    A failed CONCURRENTLY build leaves an INVALID index behind, which
+    IF NOT EXISTS would then skip, so it is dropped and rebuilt first.
+    """
+    invalid = conn.execute(
+        text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {ddl}"))
+
+
+def _migration_posts_indexes(conn):
+    _create_index_concurrently(conn, "ix_posts_tags", "ON posts USING gin (tags)")
+    _create_index_concurrently(
+        conn,
+        "ix_posts_author_timestamp",
+        'ON posts (author, "timestamp" DESC, message_id DESC)',
+    )
+    _create_index_concurrently(
+        conn, "ix_posts_timestamp", 'ON posts ("timestamp" DESC, message_id DESC)'
+    )
+
+
+def _migration_file_refs(conn):
+    # Nullable without default, so this is a catalog-only change
+    conn.execute(text("ALTER TABLE posts ADD COLUMN IF NOT EXISTS file_refs JSONB"))
+
+
+def _migration_import_jobs(conn):
+    ImportJob.__table__.create(conn, checkfirst=True)
+
+
+def _migration_search_vector(conn):
+    # A stored generated column is computed for every existing row, which
+    # rewrites the table under an exclusive lock: run it at a quiet time
+    conn.execute(
+        text(
+            "ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(message, ''))) STORED"
+        )
+    )
+    _create_index_concurrently(conn, "ix_posts_search", "ON posts USING gin (search_vector)")
+
+
+# Statement-level, so a COPY of 10k posts updates each counter once.
+# {changed} selects (author, tags, delta) from the transition tables.
+STATS_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    -- Sorted so concurrent writers lock counter rows in the same order
+    INSERT INTO author_stats AS s (author, posts)
+    SELECT author, sum(delta) FROM ({changed}) c
+    GROUP BY author HAVING sum(delta) <> 0 ORDER BY author
+    ON CONFLICT (author) DO UPDATE SET posts = s.posts + EXCLUDED.posts;
+
+    INSERT INTO tag_stats AS s (tag, posts)
+    SELECT t.tag, sum(c.delta) FROM ({changed}) c
+    CROSS JOIN LATERAL (SELECT DISTINCT unnest(c.tags) AS tag) t
+    GROUP BY t.tag HAVING sum(c.delta) <> 0 ORDER BY t.tag
+    ON CONFLICT (tag) DO UPDATE SET posts = s.posts + EXCLUDED.posts;
+
+    INSERT INTO author_tag_stats AS s (author, tag, posts)
+    SELECT c.author, t.tag, sum(c.delta) FROM ({changed}) c
+    CROSS JOIN LATERAL (SELECT DISTINCT unnest(c.tags) AS tag) t
+    GROUP BY c.author, t.tag HAVING sum(c.delta) <> 0 ORDER BY c.author, t.tag
+    ON CONFLICT (author, tag) DO UPDATE SET posts = s.posts + EXCLUDED.posts;
+
+    RETURN NULL;
+END
+$$
+"""
+
+# (event, trigger function, transition tables, rows they contribute)
+STATS_TRIGGERS = [
+    ("INSERT", "posts_stats_insert", "NEW TABLE AS new_rows",
+     "SELECT author, tags, 1 AS delta FROM new_rows"),
+    ("DELETE", "posts_stats_delete", "OLD TABLE AS old_rows",
+     "SELECT author, tags, -1 AS delta FROM old_rows"),
+    ("UPDATE", "posts_stats_update", "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+     "SELECT author, tags, -1 AS delta FROM old_rows "
+     "UNION ALL SELECT author, tags, 1 FROM new_rows"),
+]
+
+
+def _migration_stats(conn):
+    for model in (TagStat, AuthorStat, AuthorTagStat):
+        model.__table__.create(conn, checkfirst=True)
+
+    # Counting and installing the triggers in one transaction, with writes
+    # to posts blocked, so no post is missed or counted twice
+    with engine.begin() as tx:
+        tx.execute(text("LOCK TABLE posts IN SHARE ROW EXCLUSIVE MODE"))
+        tx.execute(text("TRUNCATE tag_stats, author_stats, author_tag_stats"))
+        tx.execute(
+            text(
+                "INSERT INTO author_stats (author, posts) "
+                "SELECT author, count(*) FROM posts GROUP BY author"
+            )
+        )
+        tx.execute(
+            text(
+                "INSERT INTO tag_stats (tag, posts) "
+                "SELECT tag, count(DISTINCT message_id) FROM posts, unnest(tags) AS tag GROUP BY tag"
+            )
+        )
+        tx.execute(
+            text(
+                "INSERT INTO author_tag_stats (author, tag, posts) "
+                "SELECT author, tag, count(DISTINCT message_id) FROM posts, unnest(tags) AS tag "
+                "GROUP BY author, tag"
+            )
+        )
+        for event_, name, referencing, changed in STATS_TRIGGERS:
+            tx.execute(text(STATS_TRIGGER_FUNCTION.format(name=name, changed=changed)))
+            tx.execute(text(f"DROP TRIGGER IF EXISTS {name} ON posts"))
+            tx.execute(
+                text(
+                    f"CREATE TRIGGER {name} AFTER {event_} ON posts "
+                    f"REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION {name}()"
+                )
+            )
+
+
+# (version, name, function). Append only, never edit an applied migration.
+MIGRATIONS = [
+    (1, "posts indexes", _migration_posts_indexes),
+    (2, "posts.file_refs", _migration_file_refs),
+    (3, "import_jobs", _migration_import_jobs),
+    (4, "posts.search_vector", _migration_search_vector),
+    (5, "tag and author stats", _migration_stats),
+]
+
+# Arbitrary key for pg_advisory_lock so two instances never migrate at once
+MIGRATION_LOCK_ID = 7263011
+
+
+def migrate():
+    """Apply pending migrations. Returns the list of applied versions."""
+    applied_now = []
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            conn.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "version INTEGER PRIMARY KEY, "
+                    "name TEXT NOT NULL, "
+                    "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                )
+            )
+            applied = {
+                row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))
+            }
+
+            for version, name, migration in MIGRATIONS:
+                if version in applied:
+                    continue
+                migration(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                    {"v": version, "n": name},
+                )
+                applied_now.append(version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+    return applied_now
 
 
 def init_db():
-    """Creates tables if they do not exist."""
+    """Creates tables if they do not exist, then applies pending migrations."""
     Base.metadata.create_all(engine)
+    migrate()
+
+def backfill_file_refs(batch_size=1000):
+    """Fill file_refs for rows written before it existed. Returns the row count.
+
+    Walks the table by message_id in batches, one short transaction each,
+    so it can run next to the bot and be interrupted and restarted.
+    """
+    done = 0
+    last_id = ""
+    while True:
+        rows = session.execute(
+            text(
+                "SELECT message_id, files FROM posts "
+                "WHERE file_refs IS NULL AND message_id > :last_id "
+                "ORDER BY message_id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": batch_size},
+        ).all()
+        if not rows:
+            return done
+
+        session.execute(
+            text(
+                "UPDATE posts SET file_refs = CAST(:refs AS JSONB) "
+                "WHERE message_id = :message_id AND file_refs IS NULL"
+            ),
+            [
+                {
+                    "message_id": message_id,
+                    "refs": json.dumps([file_ref(url) for url in files or []]),
+                }
+                for message_id, files in rows
+            ],
+        )
+        session.commit()
+
+        done += len(rows)
+        last_id = rows[-1][0]
+        print(f"Backfilled file_refs for {done} posts")
+
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    if sys.argv[1:] == ["backfill-file-refs"]:
+        backfill_file_refs()
+    else:
+        init_db()
\ No newline at end of file
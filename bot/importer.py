@@ -0,0 +1,111 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import ijson
+import requests
+
+from database import ImportJob, Post, session
+
+logger = logging.getLogger(__name__)
+
+
+def post_from_scrapbook(post_data, userid):
+    """Post for one entry of the scrapbook API, None if it is malformed."""
+    try:
+        tags = [tag["name"] for tag in post_data.get("reactions")]
+        ts = datetime.fromtimestamp(float(post_data.get("timestamp")), tz=timezone.utc)
+        return Post(
+            message_id=post_data.get("id"),
+            message=post_data.get("text"),
+            author=userid,
+            timestamp=ts,
+            tags=tags,
+            files=post_data.get("attachments", []),
+        )
+    except Exception:
+        return None
+
+
+class ScrapbookImporter:
+    """Runs /import-scrapbook jobs in the background.
+
+    The scrapbook response is parsed as a stream and saved every
+    `chunk_size` posts, so memory does not grow with the account size.
+    Progress is checkpointed in import_jobs after each chunk: a job cut
+    short by a restart is picked up by resume() and skips the posts it
+    already read. Only one job per user runs at a time. `on_saved`, if
+    given, is called with every chunk of posts after it is saved.
+    """
+
+    def __init__(self, notify, base_url, chunk_size=500, workers=2, timeout=(5, 60), on_saved=None):
+        self.notify = notify
+        self.on_saved = on_saved
+        self.base_url = base_url
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import")
+
+    def start(self, userid, username):
+        """Queue an import. False if the user already has one running."""
+        if not ImportJob.claim(userid, username):
+            return False
+        self._pool.submit(self._run, userid)
+        return True
+
+    def resume(self):
+        """Restart jobs left running by a previous process."""
+        for job in ImportJob.get_running():
+            self._pool.submit(self._run, job.user_id)
+
+    def _run(self, userid):
+        job = ImportJob.get(userid)
+        try:
+            self._import(job)
+        except Exception as e:
+            logger.exception("Import for %s failed", userid)
+            session.rollback()
+            job.finish("failed", error=str(e))
+            self.notify(
+                userid,
+                f"Unable to import your scrapbook :sadgua: "
+                f"({job.imported} posts were imported)\n```{e}```",
+            )
+            return
+
+        job.finish("done")
+        self.notify(userid, f":agabusiness: {job.imported} posts exported!")
+
+    def _import(self, job):
+        skip = job.processed
+        processed = 0
+        imported = job.imported
+        chunk = []
+
+        url = f"{self.base_url}users/{job.username}"
+        with requests.get(url, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+
+            for post_data in ijson.items(r.raw, "posts.item", use_float=True):
+                processed += 1
+                if processed <= skip:
+                    continue
+
+                post = post_from_scrapbook(post_data, job.user_id)
+                if post is not None:
+                    chunk.append(post)
+
+                if processed % self.chunk_size == 0:
+                    imported += self._save(chunk)
+                    chunk = []
+                    job.checkpoint(processed, imported)
+
+        imported += self._save(chunk)
+        job.checkpoint(processed, imported)
+
+    def _save(self, chunk):
+        imported = Post.save_batch(chunk)
+        if self.on_saved is not None:
+            self.on_saved(chunk)
+        return imported
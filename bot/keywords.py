@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+")
+
+
+class KeywordMatcher:
+    """Finds reactions.json keywords in a message in a single scan.
+
+    Keywords only match as whole words ("ts" does not match in "tests"),
+    case-insensitively. The file is re-read when its mtime changes, so
+    keywords can be edited without restarting the bot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        # Fail at startup rather than on the first message
+        self._load(os.stat(path).st_mtime)
+
+    @property
+    def reactions(self):
+        """Full content of the reactions file."""
+        self._reload_if_changed()
+        return self._reactions
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return  # Keep the last good version
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._load(mtime)
+                    except (OSError, ValueError, KeyError):
+                        # Keep the last good version until the file is fixed
+                        logger.exception("Unable to reload %s", self.path)
+                        self._mtime = mtime
+
+    def _load(self, mtime):
+        with open(self.path, "r", encoding="utf-8") as f:
+            reactions = json.load(f)
+
+        kv = {keyword.lower(): emoji for keyword, emoji in reactions["kv"].items() if keyword}
+
+        # Plain words are looked up in kv for each word of the message, so
+        # the cost does not grow with the number of keywords. Only keywords
+        # with spaces or punctuation ("hack club", "c++") go into a regex.
+        phrases = [keyword for keyword in kv if not WORD.fullmatch(keyword)]
+        pattern = None
+        if phrases:
+            # Longest first so a longer overlapping phrase wins
+            alternatives = "|".join(
+                re.escape(keyword) for keyword in sorted(phrases, key=len, reverse=True)
+            )
+            pattern = re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+        # Swapped in one assignment so match() never mixes two versions
+        self._compiled = (pattern, kv)
+        self._reactions = reactions
+        self._mtime = mtime
+
+    def match(self, message):
+        """Matched keywords mapped to their emoji, in order of first appearance."""
+        self._reload_if_changed()
+        pattern, kv = self._compiled
+        message = (message or "").lower()
+
+        hits = [(m.start(), m.group(0)) for m in WORD.finditer(message) if m.group(0) in kv]
+        if pattern is not None:
+            hits.extend((m.start(), m.group(0)) for m in pattern.finditer(message))
+            hits.sort()
+
+        found = {}
+        for _, keyword in hits:
+            if keyword not in found:
+                found[keyword] = kv[keyword]
+        return found
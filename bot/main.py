@@ -1,127 +1,115 @@
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk.web.client import WebClient
-from datetime import datetime, timezone
 from dotenv import load_dotenv
 from slack_bolt import App
+from common import (
+    CHANNELS,
+    keyword_matcher,
+    media_files,
+    post_from_message,
+    requested_user,
+    posts_view,
+    create_reaction_coalescer,
+    create_scrapbook_importer,
+)
+import metrics
+from slack_scheduler import SlackScheduler
+from media import MediaMirror
 from database import *
 from os import getenv
 import traceback
-import requests
-import json
-import re
 
 load_dotenv()
-app = App()
+# SLACK_API_URL lets the bot run against a local fake of the Web API
+api_url = getenv("SLACK_API_URL")
+if api_url:
+    app = App(client=WebClient(token=getenv("SLACK_BOT_TOKEN"), base_url=api_url))
+else:
+    app = App()
 bot_id = getenv("BOT_UID", "U09VC4NQXC6")
-UNESCAPED_USER_PATTERN = r".+@(U[A-Z0-9]+).+"
 
-reactions = {}
-with open("reactions.json", "r", encoding="utf-8") as f:
-    # load reactions or die
-    reactions = json.load(f)
+# Every Web API call goes through here: rate limited per method,
+# confirmations before reactions, 429s and transient errors retried
+slack = SlackScheduler(app.client, workers=int(getenv("SLACK_WORKERS", 4)))
 
+# Copies of post files the API serves instead of asking Slack, off unless MEDIA_STORE_DIR is set
+media_mirror = MediaMirror.from_env()
 
-def remove_reactions(shortcut, client):
+
+def remove_reactions(shortcut):
     ts = shortcut["message"]["ts"]
     channel = shortcut["channel"]["id"]
 
-    result = client.conversations_history(
-        channel=channel, latest=ts, inclusive=True, limit=1
-    )
+    result = slack.call(
+        "conversations_history", channel=channel, latest=ts, inclusive=True, limit=1
+    ).result()
 
     message = result.get("messages", [])[0]
     reactions = message.get("reactions", [])
 
-    for reaction in reactions:
-        if bot_id not in reaction["users"]:
-            continue
-
-        client.reactions_remove(channel=channel, timestamp=ts, name=reaction["name"])
+    futures = [
+        slack.call(
+            "reactions_remove", channel=channel, timestamp=ts, name=reaction["name"],
+            ignore_errors=("no_reaction",),
+        )
+        for reaction in reactions
+        if bot_id in reaction["users"]
+    ]
+    for future in futures:
+        future.result()
 
 
-def add_reactions(shortcut, client):
+def add_reactions(shortcut):
     message = shortcut["message"]["text"]
     channel = shortcut["channel"]["id"]
     ts = shortcut["message"]["ts"]
 
-    tags = []
-    for keyword, emoji in reactions["kv"].items():
-        if keyword not in message:
-            continue
-
-        try:
-            client.reactions_add(channel=channel, timestamp=ts, name=emoji)
-        except:
-            pass
-
-        tags.append(keyword)
-
-    return tags
-
-
-def get_reactions(message: dict, author_id: str, bot_id: str) -> list[str]:
-    reactions = set()
-
-    authorized = [author_id, bot_id, "U015D6A36AG"]  # scrappy
-
-    for reaction in message.get("reactions", []):
-        if any(user in [authorized] for user in reaction["users"]) and not (
-            any(reaction["name"] in reactions["blacklist"])
-        ):
-            reactions.add(reaction["name"])
-    return list(reactions)
+    matches = keyword_matcher.match(message)
 
+    # One call per emoji, even when several keywords map to it. Not waited
+    # for: they are queued behind confirmations and failures are logged by
+    # the scheduler, a missing reaction should not hold the post back.
+    for emoji in dict.fromkeys(matches.values()):
+        slack.call(
+            "reactions_add", channel=channel, timestamp=ts, name=emoji,
+            ignore_errors=("already_reacted",),
+        )
 
-def process_message_post(
-    message: dict, channel: str, client: WebClient
-) -> tuple[bool, str]:
-    content = message["text"]
-    msg_id = message["client_msg_id"]
-    author = message["user"]
-    ts = datetime.fromtimestamp(float(message["ts"]), tz=timezone.utc)
+    return list(matches)
 
-    files = []
-    for file in message.get("files", []):
-        if not (
-            file["mimetype"].startswith("image/")
-            or file["mimetype"].startswith("video/")
-        ):
-            continue
-        files.append(file["url_private"])
 
-    if len(files) == 0:
+def process_message_post(message: dict, channel: str) -> tuple[bool, str]:
+    if len(media_files(message)) == 0:
         return False, "You need to have images or videos in your post"
 
-    tags = add_reactions({"message": message, "channel": {"id": channel}}, client)
+    tags = add_reactions({"message": message, "channel": {"id": channel}})
 
-    post = Post(
-        message_id=msg_id,
-        author=author,
-        message=content,
-        timestamp=ts,
-        tags=tags,
-        files=files,
-    )
+    post = post_from_message(message, tags)
 
     success = post.save()
 
     if success:
+        if media_mirror is not None:
+            media_mirror.enqueue(post.file_refs)
         return True, "Your post has been saved!"
     else:
         return False, "This has already been post :sadgua:"
 
 
 @app.event("message")
-def new_message(event, say, client):
-    if event.get("channel") not in ["C09VC37P2NA", "C01504DCLVD"]:
-        # Only #scrappy-doo or #scrapbook
+@metrics.timed("message")
+def new_message(event, say):
+    if event.get("channel") not in CHANNELS:
         return
 
     if event.get("subtype") == "message_deleted":
         msg_id = event["previous_message"]["client_msg_id"]
-        Post.delete_by_id(msg_id)
+        post = Post.delete_by_id(msg_id)
+        if post is not None and media_mirror is not None:
+            media_mirror.remove(post.file_refs)
 
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=event["channel"],
             user=event["previous_message"]["user"],
             text=f"Your post has been deleted :agabye:",
@@ -135,7 +123,8 @@ def new_message(event, say, client):
 
     # Check if message has files before processing
     if not event.get("files"):
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=event["channel"],
             user=event["user"],
             text="You need to have images or videos in your post",
@@ -143,49 +132,48 @@ def new_message(event, say, client):
         return
 
     try:
-        success, msg = process_message_post(
-            message=event, channel=event["channel"], client=client
-        )
+        success, msg = process_message_post(message=event, channel=event["channel"])
 
         # Show message for both success and failure
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=event["channel"],
             user=event["user"],
             text=msg,
         )
     except Exception as e:
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=event["channel"],
             user=event["user"],
             text=f"Unable to auto-post this message :sadgua:\n```{str(e)}```",
         )
 
 
+# Bursts of reactions on a message become one fetch and one tag write
+reaction_updates = create_reaction_coalescer(
+    lambda method, **kwargs: slack.call(method, **kwargs).result(), bot_id, app.logger
+)
+
+metrics.register_stats(scheduler=slack, coalescer=reaction_updates, mirror=media_mirror)
+metrics.instrument_engine(engine, slow_query_ms=float(getenv("DB_SLOW_QUERY_MS", 200)))
+
+
 @app.event("reaction_added")
 @app.event("reaction_removed")
+@metrics.timed("reaction")
 def handle_reaction(event, say, client):
     if event["user"] != event["item_user"]:
         return
 
-    response = client.conversations_history(
-        channel=event["item"]["channel"],
-        latest=event["item"]["ts"],
-        inclusive=True,
-        limit=1,
+    reaction_updates.submit(
+        (event["item"]["channel"], event["item"]["ts"]), event["item_user"]
     )
-    message = response["messages"][0]
-    msg_id = message["client_msg_id"]
-
-    post = Post.get_by_id(msg_id)
-    if not post:
-        return
-
-    reactions = get_reactions(message, event["item_user"], bot_id)
-    post.set_tags(reactions)
 
 
 @app.shortcut("unpost_message")
-def handle_unpost(ack, shortcut, client):
+@metrics.timed("unpost_message")
+def handle_unpost(ack, shortcut):
     try:
         ack()
 
@@ -195,152 +183,70 @@ def handle_unpost(ack, shortcut, client):
         shortcut_author = shortcut["user"]["id"]
 
         if author != shortcut_author:
-            client.chat_postEphemeral(
+            slack.call(
+                "chat_postEphemeral",
                 channel=channel,
                 user=shortcut_author,
                 text="You can only unpost your own post :sadgua:",
             )
             return
 
-        remove_reactions(shortcut, client)
-        success = Post.delete_by_id(msg_id)
+        remove_reactions(shortcut)
+        post = Post.delete_by_id(msg_id)
 
-        if success:
-            client.chat_postEphemeral(
+        if post is not None:
+            if media_mirror is not None:
+                media_mirror.remove(post.file_refs)
+            slack.call(
+                "chat_postEphemeral",
                 channel=channel,
                 user=author,
                 text="You're post have been deleted!",
             )
     except:
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=channel,
             user=author,
             text=f"Unable to delete this post :sadgua:\n```{traceback.format_exc()}```",
         )
 
 
+def notify_user(userid, text):
+    # Direct message, it still works long after the slash command expired
+    slack.call("chat_postMessage", channel=userid, text=text)
+
+
+scrapbook_importer = create_scrapbook_importer(notify_user, media_mirror)
+
+
 @app.command("/import-scrapbook")
+@metrics.timed("/import-scrapbook")
 def import_scrapbook(ack, respond, command):
     ack()
     username = command["user_name"]
     userid = command["user_id"]
 
-    r = requests.get(f"https://scrapbook.hackclub.com/api/users/{username}")
-    data = r.json()
-    r.raise_for_status()
-
-    posts_to_import = []
-    for post_data in data.get("posts", []):
-        try:
-            tags = [tag["name"] for tag in post_data.get("reactions")]
-
-            ts = datetime.fromtimestamp(
-                float(post_data.get("timestamp")), tz=timezone.utc
-            )
-            post = Post(
-                message_id=post_data.get("id"),
-                message=post_data.get("text"),
-                author=userid,
-                timestamp=ts,
-                tags=tags,
-                files=post_data.get("attachments", []),
-            )
-            posts_to_import.append(post)
-        except Exception as e:
-            pass
-
-    success_count = Post.save_batch(posts_to_import)
-    respond(f":agabusiness: {success_count} posts exported!")
+    if scrapbook_importer.start(userid, username):
+        respond(":agabusiness: Importing your scrapbook, I'll DM you when it's done!")
+    else:
+        respond("An import is already running for you :sadgua:")
 
 
 @app.command("/posts")
-def userinfo(ack, respond, command, client):
+@metrics.timed("/posts")
+def userinfo(ack, respond, command):
     ack()
 
-    userid = command["user_id"]
-
-    if len(command["text"]) != 0:
-        match = re.match(UNESCAPED_USER_PATTERN, command["text"])
-        if match:
-            if match.group(1):
-                userid = match.group(1)
-
+    userid = requested_user(command)
     posts = Post.get_by_author(userid, limit=5)
 
-    def format_post_block(post):
-        ts_str = post.timestamp.strftime("%Y-%m-%d %H:%M UTC")
-        tags_str = ", ".join(post.tags) if post.tags else "No tags"
-        file_count = len(post.files) if post.files else 0
-
-        # Section with message text
-        blocks = [
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*{ts_str}*\n{post.message or '_No text_'}",
-                },
-            },
-            {
-                "type": "context",
-                "elements": [
-                    {"type": "mrkdwn", "text": f"Tags: `{tags_str}`"},
-                    {"type": "mrkdwn", "text": f"Files: {file_count}"},
-                ],
-            },
-        ]
-
-        if post.files:
-            blocks.append(
-                {"type": "image", "image_url": post.files[0], "alt_text": "attachment"}
-            )
-
-        blocks.append({"type": "divider"})
-        return blocks
-
-    blocks = []
-    if posts:
-        blocks.append(
-            {
-                "type": "header",
-                "text": {"type": "plain_text", "text": "User Posts", "emoji": True},
-            }
-        )
-        blocks.append(
-            {
-                "type": "context",
-                "elements": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"Showing latest {len(posts)} posts for <@{userid}>",
-                    }
-                ],
-            }
-        )
-        blocks.append({"type": "divider"})
-        for post in posts:
-            blocks.extend(format_post_block(post))
-    else:
-        blocks = [
-            {
-                "type": "section",
-                "text": {"type": "mrkdwn", "text": f"No posts found for <@{userid}>."},
-            }
-        ]
-
-    client.views_open(
-        trigger_id=command["trigger_id"],
-        view={
-            "type": "modal",
-            "title": {"type": "plain_text", "text": "User Info"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "blocks": blocks,
-        },
-    )
+    slack.call("views_open", trigger_id=command["trigger_id"], view=posts_view(userid, posts))
 
 
 @app.shortcut("post_message")
-def handle_post(ack, shortcut, client: WebClient):
+@metrics.timed("post_message")
+def handle_post(ack, shortcut):
     try:
         ack()
 
@@ -350,24 +256,25 @@ def handle_post(ack, shortcut, client: WebClient):
         shortcut_author = shortcut["user"]["id"]
 
         if author != shortcut_author:
-            client.chat_postEphemeral(
+            slack.call(
+                "chat_postEphemeral",
                 channel=channel,
                 user=shortcut_author,
                 text="You can only post your own message :sadgua:",
             )
             return
 
-        success, msg = process_message_post(
-            message=message, channel=channel, client=client
-        )
+        success, msg = process_message_post(message=message, channel=channel)
 
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=channel,
             user=author,
             text=msg,
         )
     except:
-        client.chat_postEphemeral(
+        slack.call(
+            "chat_postEphemeral",
             channel=channel,
             user=author,
             text=f"Unable to post this message :sadgua:\n```{traceback.format_exc()}```",
@@ -375,5 +282,8 @@ def handle_post(ack, shortcut, client: WebClient):
 
 
 if __name__ == "__main__":
+    if getenv("METRICS_PORT"):
+        metrics.serve(int(getenv("METRICS_PORT")))
+    scrapbook_importer.resume()
     handler = SocketModeHandler(app)
     handler.start()
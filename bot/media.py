@@ -0,0 +1,429 @@
+"""Local mirror of the files attached to posts, filled at ingest time.
+
+Each file is stored once per content as ``blobs/<sha256[:2]>/<sha256>``,
+and ``files/<file id>/<filename>`` is a hard link to its blob: the path
+the API serves ``/file/<id>/<filename>`` from, without asking Slack.
+Downloads run on a fixed pool of threads fed by a bounded queue, so
+saving a post never waits for them. Files dropped from a full queue or
+that failed are still proxied from Slack, and `python media.py backfill`
+mirrors the posts saved before.
+
+Deleting a post unlinks its files with remove(), and a background sweep
+deletes the blobs no file links to anymore (`st_nlink` back to 1).
+`python media.py gc` also unlinks the files of posts deleted while the
+bot was not running.
+"""
+import hashlib
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Temporary files older than this were left by a crash
+STALE_TMP_SECONDS = 3600
+
+
+class TransientError(Exception):
+    """Download worth trying again later: 429, 5xx, connection errors."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class MediaMirror:
+    """Downloads the Slack files of saved posts into a content-addressed store."""
+
+    def __init__(
+        self,
+        directory,
+        token,
+        files_url="https://files.slack.com/files-pri/",
+        workers=4,
+        queue_size=10000,
+        max_file_bytes=200 * 1024 * 1024,
+        retries=3,
+        backoff=2.0,
+        timeout=(5, 60),
+        max_store_bytes=None,
+        gc_interval=3600,
+    ):
+        self.directory = directory
+        self.files_url = files_url
+        self.max_file_bytes = max_file_bytes
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_store_bytes = max_store_bytes
+
+        self.mirrored = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.full = 0
+        self.removed = 0
+        self.collected = 0
+        # Size of the blobs, measured by each sweep and grown by new blobs in between
+        self.stored_bytes = 0
+
+        self._tmp_dir = os.path.join(directory, "tmp")
+        for sub in ("blobs", "files", "tmp"):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+        self._clean_tmp()
+
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bearer {token}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._pending = set()  # (file id, filename) queued or downloading
+        self._removed = set()  # pending keys whose post was deleted meanwhile
+        self._queue = queue.Queue(maxsize=queue_size)
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"media-{i}", daemon=True).start()
+        if gc_interval:
+            threading.Thread(target=self._collect_every, args=(gc_interval,), name="media-gc", daemon=True).start()
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Mirror configured by the MEDIA_* variables, None unless MEDIA_STORE_DIR is set."""
+        if not os.getenv("MEDIA_STORE_DIR"):
+            return None
+        options = {
+            "files_url": os.getenv("SLACK_FILES_URL", "https://files.slack.com/files-pri/"),
+            "workers": int(os.getenv("MEDIA_WORKERS", 4)),
+            "queue_size": int(os.getenv("MEDIA_QUEUE_SIZE", 10000)),
+            "max_file_bytes": int(os.getenv("MEDIA_MAX_FILE_BYTES", 200 * 1024 * 1024)),
+            "max_store_bytes": int(os.getenv("MEDIA_MAX_STORE_BYTES", 0)) or None,
+            "gc_interval": int(os.getenv("MEDIA_GC_INTERVAL", 3600)),
+        }
+        options.update(overrides)
+        return cls(os.getenv("MEDIA_STORE_DIR"), os.getenv("SLACK_BOT_TOKEN"), **options)
+
+    def _clean_tmp(self):
+        for name in os.listdir(self._tmp_dir):
+            path = os.path.join(self._tmp_dir, name)
+            try:
+                if os.stat(path).st_mtime < time.time() - STALE_TMP_SECONDS:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def path(self, file_id, filename):
+        """Where the mirrored file lives, None for ids or names unsafe in a path.
+
+        Takes the decoded segments, as Flask passes them to the API.
+        """
+        for part in (file_id, filename):
+            if part in ("", ".", "..") or "/" in part or os.sep in part:
+                return None
+        return os.path.join(self.directory, "files", file_id, filename)
+
+    def ref_path(self, ref):
+        """path() of a Slack file ref, whose segments are kept percent-encoded as in the URL."""
+        return self.path(unquote(ref["id"]), unquote(ref["name"]))
+
+    def enqueue(self, file_refs, block=False):
+        """Queue the Slack files of a post that are not mirrored yet.
+
+        Files that do not fit in the queue are counted in `dropped`, unless
+        `block` is set, then this waits for room. Once the store holds
+        `max_store_bytes`, new files are counted in `full` and left to the
+        Slack proxy.
+        """
+        for ref in file_refs or ():
+            if ref.get("source") != "slack":
+                continue
+            key = (ref["id"], ref["name"])
+            path = self.ref_path(ref)
+            if path is None or os.path.exists(path):
+                continue
+            if self.max_store_bytes and self.stored_bytes >= self.max_store_bytes:
+                with self._lock:
+                    self.full += 1
+                continue
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            try:
+                self._queue.put(key, block=block)
+            except queue.Full:
+                with self._lock:
+                    self._pending.discard(key)
+                    self.dropped += 1
+
+    def enqueue_posts(self, posts):
+        for post in posts:
+            self.enqueue(post.file_refs)
+
+    def remove(self, file_refs):
+        """Unlink the mirrored files of a deleted post, so the API stops serving them.
+
+        Their blobs are deleted by the next collect() once nothing else links them.
+        """
+        for ref in file_refs or ():
+            if ref.get("source") != "slack":
+                continue
+            path = self.ref_path(ref)
+            if path is None:
+                continue
+            key = (ref["id"], ref["name"])
+            with self._lock:
+                if key in self._pending:
+                    self._removed.add(key)
+                try:
+                    os.unlink(path)
+                    self.removed += 1
+                except FileNotFoundError:
+                    pass
+                try:
+                    os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass
+
+    def collect(self):
+        """Delete the blobs no file links to anymore, returns how many.
+
+        Blobs younger than STALE_TMP_SECONDS are kept: a worker may be about
+        to link them.
+        """
+        blobs_dir = os.path.join(self.directory, "blobs")
+        deadline = time.time() - STALE_TMP_SECONDS
+        collected = 0
+        stored = 0
+        for prefix in os.listdir(blobs_dir):
+            for name in os.listdir(os.path.join(blobs_dir, prefix)):
+                blob = os.path.join(blobs_dir, prefix, name)
+                try:
+                    st = os.stat(blob)
+                    if st.st_nlink == 1 and st.st_mtime < deadline:
+                        # A worker linking it right now keeps its own link to the content
+                        os.unlink(blob)
+                        collected += 1
+                    else:
+                        stored += st.st_size
+                except FileNotFoundError:
+                    pass
+        self._clean_tmp()
+        with self._lock:
+            self.collected += collected
+            self.stored_bytes = stored
+        return collected
+
+    def _collect_every(self, interval):
+        while True:
+            try:
+                self.collect()
+            except Exception:
+                logger.exception("Unable to collect unused blobs")
+            time.sleep(interval)
+
+    def join(self):
+        """Wait until every queued file is mirrored or failed."""
+        self._queue.join()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "mirrored": self.mirrored,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "bytes": self.bytes,
+            "full": self.full,
+            "removed": self.removed,
+            "collected": self.collected,
+            "stored_bytes": self.stored_bytes,
+        }
+
+    def _work(self):
+        while True:
+            key = self._queue.get()
+            try:
+                if not self._mirror(*key):
+                    with self._lock:
+                        self.failed += 1
+            except Exception:
+                logger.exception("Unable to mirror %s/%s", *key)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                    self._removed.discard(key)
+                self._queue.task_done()
+
+    def _mirror(self, file_id, filename):
+        """Download one file into the store. False if it cannot be mirrored."""
+        for attempt in range(self.retries + 1):
+            try:
+                downloaded = self._download(file_id, filename)
+                break
+            except (TransientError, requests.RequestException) as e:
+                if attempt == self.retries:
+                    logger.warning("Giving up on %s/%s: %s", file_id, filename, e)
+                    return False
+                delay = self.backoff * 2**attempt
+                if isinstance(e, TransientError) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                time.sleep(delay)
+
+        if downloaded is None:
+            return False
+        digest, tmp_path, size = downloaded
+        self._store(file_id, filename, digest, tmp_path, size)
+        return True
+
+    def _download(self, file_id, filename):
+        """(sha256, temporary path, size), None if Slack will never serve it."""
+        url = f"{self.files_url}{file_id}/{filename}"
+        with self._session.get(url, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 429 or r.status_code >= 500:
+                retry_after = r.headers.get("Retry-After")
+                raise TransientError(
+                    f"HTTP {r.status_code}",
+                    retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+                )
+            if r.status_code != 200:
+                logger.warning("Unable to mirror %s: HTTP %d", url, r.status_code)
+                return None
+            # Slack answers a missing scope or expired token with its login page
+            if r.headers.get("Content-Type", "").startswith("text/html") and not filename.endswith(
+                (".html", ".htm")
+            ):
+                logger.warning("Unable to mirror %s: got an HTML page", url)
+                return None
+            length = r.headers.get("Content-Length")
+            if length and int(length) > self.max_file_bytes:
+                return None
+
+            digest = hashlib.sha256()
+            size = 0
+            fd, tmp_path = tempfile.mkstemp(prefix="blob-", dir=self._tmp_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_file_bytes:
+                            os.unlink(tmp_path)
+                            return None
+                        digest.update(chunk)
+                        f.write(chunk)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return digest.hexdigest(), tmp_path, size
+
+    def _store(self, file_id, filename, digest, tmp_path, size):
+        blob = os.path.join(self.directory, "blobs", digest[:2], digest)
+        # Link under a temporary name, then rename: readers see the whole file or nothing.
+        # Linking the blob first means collect() cannot delete it between the check and the link.
+        tmp_link = os.path.join(self._tmp_dir, f"link-{digest}-{threading.get_ident()}")
+        try:
+            os.link(blob, tmp_link)
+            new = False
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            # Unlike a rename, fails when another worker stored the same content meanwhile
+            try:
+                os.link(tmp_path, blob)
+                new = True
+            except FileExistsError:
+                new = False
+            os.link(blob, tmp_link)
+        os.unlink(tmp_path)
+        with self._lock:
+            if new:
+                self.mirrored += 1
+                self.bytes += size
+                self.stored_bytes += size
+            else:
+                self.deduplicated += 1
+
+        path = self.ref_path({"id": file_id, "name": filename})
+        with self._lock:
+            if (file_id, filename) in self._removed:
+                # The post was deleted while its file downloaded
+                os.unlink(tmp_link)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_link, path)
+
+
+def backfill(mirror, batch_size=1000):
+    """Mirror the files of every post already in the database."""
+    from sqlalchemy import select
+    from database import Post, session
+
+    posts = 0
+    rows = session.execute(
+        select(Post.file_refs).where(Post.file_refs.isnot(None)).execution_options(yield_per=batch_size)
+    )
+    for (file_refs,) in rows:
+        mirror.enqueue(file_refs, block=True)
+        posts += 1
+        if posts % batch_size == 0:
+            print(f"Queued the files of {posts} posts, {mirror.stats()}")
+    mirror.join()
+    print(f"Done: {mirror.stats()}")
+
+
+def prune(mirror, batch_size=1000):
+    """Unlink the mirrored files no post in the database references, then collect their blobs."""
+    from sqlalchemy import select
+    from database import Post, session
+
+    # Files linked after this point may belong to posts the query below misses
+    started = time.time()
+    referenced = set()
+    rows = session.execute(
+        select(Post.file_refs).where(Post.file_refs.isnot(None)).execution_options(yield_per=batch_size)
+    )
+    for (file_refs,) in rows:
+        for ref in file_refs:
+            if ref.get("source") == "slack":
+                referenced.add(mirror.ref_path(ref))
+
+    files_dir = os.path.join(mirror.directory, "files")
+    unlinked = 0
+    for file_id in os.listdir(files_dir):
+        for name in os.listdir(os.path.join(files_dir, file_id)):
+            path = os.path.join(files_dir, file_id, name)
+            try:
+                # Linking changes st_ctime
+                if path not in referenced and os.stat(path).st_ctime < started:
+                    os.unlink(path)
+                    unlinked += 1
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(os.path.join(files_dir, file_id))
+        except OSError:
+            pass
+    print(f"Unlinked {unlinked} files, collected {mirror.collect()} blobs: {mirror.stats()}")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    commands = {"backfill": backfill, "gc": prune}
+    # The bot's sweep runs on its own schedule
+    mirror = MediaMirror.from_env(gc_interval=0) if sys.argv[1:2] and sys.argv[1] in commands else None
+    if len(sys.argv) != 2 or mirror is None:
+        sys.exit("Usage: MEDIA_STORE_DIR=... python media.py backfill|gc")
+    commands[sys.argv[1]](mirror)
@@ -0,0 +1,155 @@
+"""Prometheus metrics of the bot, served on METRICS_PORT.
+
+Listener timings come from the @timed decorator, SQL timings from
+engine events, and the Slack scheduler, reaction coalescer and media
+mirror counters are read from their stats() when Prometheus scrapes.
+"""
+import asyncio
+import logging
+import time
+from functools import wraps
+
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 1 ms to 30 s, listeners wait on Slack and on the database
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY", "CREATE"}
+
+HANDLER_DURATION = Histogram(
+    "bot_handler_duration_seconds",
+    "Time spent in event, shortcut and command listeners",
+    ["handler", "outcome"],
+    buckets=BUCKETS,
+)
+QUERY_DURATION = Histogram(
+    "bot_db_query_duration_seconds", "Duration of SQL statements", ["operation"], buckets=BUCKETS
+)
+SLOW_QUERIES = Counter("bot_db_slow_queries_total", "SQL statements slower than DB_SLOW_QUERY_MS")
+
+
+def timed(handler):
+    """Record the duration of a listener, sync or async, under `handler`."""
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    result = await fn(*args, **kwargs)
+                    outcome = "ok"
+                    return result
+                finally:
+                    HANDLER_DURATION.labels(handler, outcome).observe(time.perf_counter() - start)
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                HANDLER_DURATION.labels(handler, outcome).observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_engine(engine, slow_query_ms=200):
+    """Time the statements of `engine` (the sync_engine of an async one) and log slow ones."""
+    slow = slow_query_ms / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        operation = statement.split(None, 1)[0].upper() if statement else ""
+        QUERY_DURATION.labels(operation if operation in SQL_OPERATIONS else "OTHER").observe(elapsed)
+        if elapsed >= slow:
+            SLOW_QUERIES.inc()
+            logger.warning("Slow query (%.0f ms): %s", elapsed * 1e3, " ".join(statement.split())[:1000])
+
+
+class StatsCollector:
+    """SlackScheduler, Coalescer and MediaMirror counters, read at scrape time."""
+
+    def __init__(self, scheduler=None, coalescer=None, mirror=None):
+        self.scheduler = scheduler
+        self.coalescer = coalescer
+        self.mirror = mirror
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        if self.scheduler is not None:
+            stats = self.scheduler.stats()
+            per_method = {
+                "calls": CounterMetricFamily("bot_slack_calls", "Finished Web API calls", labels=["method"]),
+                "failed": CounterMetricFamily("bot_slack_failures", "Web API calls that failed for good", labels=["method"]),
+                "throttled": CounterMetricFamily("bot_slack_throttled", "429 answers from Slack", labels=["method"]),
+                "seconds": CounterMetricFamily("bot_slack_call_seconds", "Time spent in Web API calls", labels=["method"]),
+            }
+            for method, values in stats["methods"].items():
+                for key, family in per_method.items():
+                    family.add_metric([method], values[key])
+            yield from per_method.values()
+
+            queued = GaugeMetricFamily("bot_slack_queued", "Web API calls waiting, by priority", labels=["priority"])
+            for priority, depth in stats["queued"].items():
+                queued.add_metric([priority], depth)
+            yield queued
+            yield GaugeMetricFamily("bot_slack_in_flight", "Web API calls running", value=stats["in_flight"])
+            yield CounterMetricFamily("bot_slack_retries", "Web API calls tried again", value=stats["retries"])
+
+        if self.coalescer is not None:
+            stats = self.coalescer.stats()
+            yield CounterMetricFamily("bot_reaction_events", "Reaction events received", value=stats["events"])
+            yield CounterMetricFamily(
+                "bot_reaction_coalesced", "Reaction events merged into another flush", value=stats["coalesced"]
+            )
+            yield GaugeMetricFamily("bot_reaction_pending", "Messages waiting for a tag update", value=stats["pending"])
+
+        if self.mirror is not None:
+            stats = self.mirror.stats()
+            yield GaugeMetricFamily("bot_media_queued", "Files waiting to be mirrored", value=stats["queued"])
+            yield CounterMetricFamily("bot_media_mirrored", "Files stored in the media mirror", value=stats["mirrored"])
+            yield CounterMetricFamily(
+                "bot_media_deduplicated", "Downloaded files whose content was already stored", value=stats["deduplicated"]
+            )
+            yield CounterMetricFamily("bot_media_failed", "Files that could not be mirrored", value=stats["failed"])
+            yield CounterMetricFamily("bot_media_dropped", "Files not queued, the queue was full", value=stats["dropped"])
+            yield CounterMetricFamily("bot_media_bytes", "Bytes stored in the media mirror", value=stats["bytes"])
+            yield CounterMetricFamily("bot_media_full", "Files not queued, the store was full", value=stats["full"])
+            yield CounterMetricFamily("bot_media_removed", "Mirrored files of deleted posts", value=stats["removed"])
+            yield CounterMetricFamily("bot_media_collected", "Blobs deleted, no file linked them", value=stats["collected"])
+            yield GaugeMetricFamily("bot_media_stored_bytes", "Size of the blobs in the store", value=stats["stored_bytes"])
+
+
+def register_stats(scheduler=None, coalescer=None, mirror=None):
+    REGISTRY.register(StatsCollector(scheduler, coalescer, mirror))
+
+
+def serve(port):
+    """Serve /metrics on `port` from a background thread."""
+    start_http_server(port)
+    logger.info("Serving metrics on port %d", port)
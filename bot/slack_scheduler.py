@@ -0,0 +1,270 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from slack_sdk.errors import SlackApiError
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first. Views need their trigger_id within 3 seconds, users
+# wait for confirmations, reactions are decorative.
+URGENT = 0
+CONFIRM = 1
+READ = 2
+DECORATIVE = 3
+PRIORITY_NAMES = {URGENT: "urgent", CONFIRM: "confirm", READ: "read", DECORATIVE: "decorative"}
+
+# https://api.slack.com/apis/rate-limits, calls per minute
+TIER_RATES = {1: 1, 2: 20, 3: 50, 4: 100}
+METHOD_RATES = {
+    "views_open": TIER_RATES[4],
+    "chat_postEphemeral": TIER_RATES[4],
+    "chat_postMessage": 60,  # "special" tier, about one message per second
+    "conversations_history": TIER_RATES[3],
+    "reactions_add": TIER_RATES[3],
+    "reactions_remove": TIER_RATES[2],
+}
+DEFAULT_RATE = TIER_RATES[3]
+
+DEFAULT_PRIORITIES = {
+    "views_open": URGENT,
+    "chat_postEphemeral": CONFIRM,
+    "chat_postMessage": CONFIRM,
+    "conversations_history": READ,
+    "reactions_add": DECORATIVE,
+    "reactions_remove": DECORATIVE,
+}
+
+# Slack errors worth another try, anything else fails right away
+RETRYABLE_ERRORS = ("ratelimited", "internal_error", "fatal_error", "request_timeout", "service_unavailable")
+
+
+class TokenBucket:
+    """`rate` calls per minute, with bursts of up to `burst` calls."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate / 60
+        self.burst = burst or max(1, rate // 6)  # about 10 seconds worth of calls
+        self.tokens = self.burst
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def ready_at(self, now):
+        """Earliest time a call can be made, `now` if one can be made right away."""
+        self._refill(now)
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready, self.paused_until)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until):
+        """Slack answered 429: no call before `until`, and start again from an empty bucket."""
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+
+class _Job:
+    __slots__ = ("method", "kwargs", "priority", "ignore_errors", "future", "attempts", "not_before", "queued_at")
+
+    def __init__(self, method, kwargs, priority, ignore_errors):
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.ignore_errors = ignore_errors
+        self.future = Future()
+        self.attempts = 0
+        self.not_before = 0.0
+        self.queued_at = time.monotonic()
+
+
+class SlackScheduler:
+    """Single way out for Web API calls, keeping each method under its rate limit.
+
+    Calls are queued per priority and per method. The dispatcher starts
+    the highest priority call whose method has a token left, so a backlog
+    of reactions never delays a confirmation. A 429 pauses the method for
+    the Retry-After Slack sent back, other transient failures are retried
+    with exponential backoff and jitter, up to `max_attempts` tries.
+    """
+
+    def __init__(self, client, workers=4, rates=None, max_attempts=5, backoff=1.0):
+        self.client = client
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.rates = {**METHOD_RATES, **(rates or {})}
+
+        self.calls = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.waited = 0.0  # seconds calls spent queued before their first attempt
+        self._method_stats = {}  # method -> {"calls", "throttled", "failed", "seconds"}
+
+        self._buckets = {}
+        self._queues = {}  # (priority, method) -> deque of _Job
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="slack")
+        self._thread = threading.Thread(target=self._run, name="slack-scheduler", daemon=True)
+        self._thread.start()
+
+    def call(self, method, priority=None, ignore_errors=(), **kwargs):
+        """Queue `client.<method>(**kwargs)`, returns a Future of its response.
+
+        Slack errors listed in `ignore_errors` ("already_reacted", ...)
+        resolve the future to None instead of failing it.
+        """
+        if priority is None:
+            priority = DEFAULT_PRIORITIES.get(method, READ)
+        job = _Job(method, kwargs, priority, ignore_errors)
+        with self._cond:
+            self._enqueue(job)
+        return job.future
+
+    def _enqueue(self, job, front=False):
+        queue = self._queues.setdefault((job.priority, job.method), deque())
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self._cond.notify()
+
+    def _bucket(self, method):
+        bucket = self._buckets.get(method)
+        if bucket is None:
+            bucket = self._buckets[method] = TokenBucket(self.rates.get(method, DEFAULT_RATE))
+        return bucket
+
+    def _next_job(self):
+        """Wait until a worker is free and a queued call may run, then dequeue it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wake = None
+                if self._in_flight < self.workers:
+                    # Queues are visited by priority, each method's queue stays FIFO
+                    for key in sorted(k for k, queue in self._queues.items() if queue):
+                        job = self._queues[key][0]
+                        ready = max(job.not_before, self._bucket(job.method).ready_at(now))
+                        if ready <= now:
+                            self._queues[key].popleft()
+                            self._bucket(job.method).take(now)
+                            self._in_flight += 1
+                            if job.attempts == 0:
+                                self.waited += now - job.queued_at
+                            return job
+                        wake = ready if wake is None else min(wake, ready)
+                self._cond.wait(None if wake is None else wake - now)
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            self._pool.submit(self._execute, job)
+
+    def _execute(self, job):
+        job.attempts += 1
+        retry_at = None
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client, job.method)(**job.kwargs)
+        except SlackApiError as e:
+            error = e.response.get("error")
+            if error in job.ignore_errors:
+                self._finish(job, result=None)
+            elif e.response.status_code == 429 or error == "ratelimited":
+                retry_at = self._throttle(job, e.response)
+                if job.attempts >= self.max_attempts:
+                    retry_at = None
+                    self._finish(job, error=e)
+            elif (error in RETRYABLE_ERRORS or e.response.status_code >= 500) and job.attempts < self.max_attempts:
+                retry_at = time.monotonic() + self._backoff(job.attempts)
+            else:
+                self._finish(job, error=e)
+        except OSError as e:
+            # Connection errors and timeouts
+            if job.attempts < self.max_attempts:
+                retry_at = time.monotonic() + self._backoff(job.attempts)
+            else:
+                self._finish(job, error=e)
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=response)
+
+        with self._cond:
+            self._in_flight -= 1
+            self._stats_for(job.method)["seconds"] += time.perf_counter() - start
+            if retry_at is not None:
+                self.retries += 1
+                job.not_before = retry_at
+                # Back in front so it keeps its place among the method's calls
+                self._enqueue(job, front=True)
+            self._cond.notify()
+
+    def _backoff(self, attempts):
+        return self.backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+
+    def _throttle(self, job, response):
+        retry_after = 1.0
+        for name, value in response.headers.items():
+            if name.lower() == "retry-after":
+                try:
+                    retry_after = float(value)
+                except ValueError:
+                    pass
+        # A little jitter so paused calls do not all come back on the same tick
+        until = time.monotonic() + retry_after + random.uniform(0, 0.5)
+        with self._cond:
+            self.throttled += 1
+            self._stats_for(job.method)["throttled"] += 1
+            self._bucket(job.method).pause(until)
+            depth = sum(len(queue) for (_, method), queue in self._queues.items() if method == job.method)
+        logger.warning(
+            "%s rate limited, pausing it for %.1fs (%d calls queued)", job.method, retry_after, depth + 1
+        )
+        return until
+
+    def _stats_for(self, method):
+        return self._method_stats.setdefault(
+            method, {"calls": 0, "throttled": 0, "failed": 0, "seconds": 0.0}
+        )
+
+    def _finish(self, job, result=None, error=None):
+        with self._cond:
+            self.calls += 1
+            stats = self._stats_for(job.method)
+            stats["calls"] += 1
+            if error is not None:
+                self.failed += 1
+                stats["failed"] += 1
+        if error is not None:
+            logger.error("Slack call %s failed after %d attempts: %s", job.method, job.attempts, error)
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for (priority, _), queue in self._queues.items():
+                queued[PRIORITY_NAMES.get(priority, str(priority))] += len(queue)
+            return {
+                "queued": queued,
+                "in_flight": self._in_flight,
+                "calls": self.calls,
+                "failed": self.failed,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "avg_wait": self.waited / self.calls if self.calls else 0.0,
+                "methods": {method: dict(stats) for method, stats in self._method_stats.items()},
+            }
@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The bot modules are imported flat and read reactions.json from the working directory
+sys.path.insert(0, os.path.join(HERE, ".."))
+os.chdir(os.path.join(HERE, ".."))
+# Local stand-ins for the Slack Web API and files.slack.com
+sys.path.insert(0, os.path.join(HERE, "..", "..", "benchmarks"))
+
+# database.py builds its URL at import; nothing connects until a query runs
+for name, default in (("DB_HOST", "localhost"), ("DB_PORT", "5432"), ("DB_NAME", "scrappy")):
+    os.environ.setdefault(name, default)
+
+TEST_PREFIX = "test-"
+
+
+@pytest.fixture(scope="session")
+def fake_api():
+    import fake_slack_api
+
+    server = fake_slack_api.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def slack_api(fake_api):
+    """The fake Web API, with no calls, scripts or messages left from other tests."""
+    fake_api.reset()
+    return fake_api
+
+
+@pytest.fixture(scope="session")
+def bot(fake_api, tmp_path_factory):
+    """main.py talking to the fake Web API, imported once per session."""
+    import importlib
+
+    os.environ.update(
+        SLACK_BOT_TOKEN="xoxb-test",
+        SLACK_SIGNING_SECRET="secret",
+        SLACK_API_URL=fake_api.url,
+        SLACK_FILES_URL="http://127.0.0.1:9/files-pri/",
+        MEDIA_STORE_DIR=str(tmp_path_factory.mktemp("media")),
+        REACTION_QUIET_SECONDS="0.1",
+        REACTION_MAX_DELAY="0.5",
+    )
+    return importlib.import_module("main")
+
+
+@pytest.fixture(scope="session")
+def database():
+    """The database of .env with migrations applied, skips when it is unreachable."""
+    import database
+    from sqlalchemy.exc import OperationalError
+
+    try:
+        database.init_db()
+    except OperationalError as e:
+        pytest.skip(f"Postgres is unreachable: {e.orig}")
+    return database
+
+
+@pytest.fixture
+def db(database):
+    """Deletes the posts written by the test (message ids starting with TEST_PREFIX)
+    and the import jobs of users starting with UTEST."""
+    from sqlalchemy import text
+
+    yield database
+    database.session.rollback()
+    database.session.execute(
+        text("DELETE FROM posts WHERE message_id LIKE :p"), {"p": TEST_PREFIX + "%"}
+    )
+    database.session.execute(text("DELETE FROM import_jobs WHERE user_id LIKE 'UTEST%'"))
+    database.session.commit()
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from coalescer import Coalescer
+
+
+class Recorder:
+    def __init__(self, fail_first=False):
+        self.batches = []
+        self.fail_first = fail_first
+        self.flushed = threading.Event()
+
+    def __call__(self, batch):
+        self.batches.append((time.monotonic(), batch))
+        self.flushed.set()
+        if self.fail_first and len(self.batches) == 1:
+            raise RuntimeError("boom")
+
+
+def test_a_burst_is_flushed_once_with_the_last_value():
+    flush = Recorder()
+    coalescer = Coalescer(flush, quiet=0.1, max_delay=5)
+    for value in range(5):
+        coalescer.submit("msg", value)
+    coalescer.submit("other", "x")
+
+    assert flush.flushed.wait(2)
+    time.sleep(0.2)
+    assert [batch for _, batch in flush.batches] == [{"msg": 4, "other": "x"}]
+    assert coalescer.stats() == {"events": 6, "flushed": 2, "batches": 1, "pending": 0, "coalesced": 4}
+
+
+def test_a_key_that_keeps_getting_events_is_flushed_after_max_delay():
+    flush = Recorder()
+    coalescer = Coalescer(flush, quiet=0.2, max_delay=0.3)
+    start = time.monotonic()
+    while not flush.batches and time.monotonic() - start < 2:
+        coalescer.submit("msg")
+        time.sleep(0.05)
+
+    assert flush.batches
+    assert flush.batches[0][0] - start < 0.5
+
+
+def test_a_failed_flush_does_not_stop_the_coalescer():
+    flush = Recorder(fail_first=True)
+    coalescer = Coalescer(flush, quiet=0.05, max_delay=1)
+    coalescer.submit("a")
+    assert flush.flushed.wait(2)
+    flush.flushed.clear()
+    coalescer.submit("b")
+    assert flush.flushed.wait(2)
+    assert [batch for _, batch in flush.batches] == [{"a": None}, {"b": None}]
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+from sqlalchemy import func, select
+
+import fake_scrapbook
+from conftest import TEST_PREFIX
+
+
+@pytest.fixture
+def scrapbook():
+    server = fake_scrapbook.start(prefix=TEST_PREFIX)
+    yield server
+    server.shutdown()
+
+
+class Notes:
+    def __init__(self):
+        self.messages = []
+        self.received = threading.Event()
+
+    def __call__(self, userid, text):
+        self.messages.append((userid, text))
+        self.received.set()
+
+
+def imported_posts(db, username):
+    return db.session.execute(
+        select(func.count()).where(db.Post.message_id.like(f"{TEST_PREFIX}{username}-%"))
+    ).scalar()
+
+
+def test_import_is_saved_in_chunks_and_reported(db, scrapbook):
+    from importer import ScrapbookImporter
+
+    scrapbook.posts["alice"] = 1200
+    chunks = []
+    notes = Notes()
+    importer = ScrapbookImporter(
+        notes, scrapbook.url, chunk_size=500, on_saved=lambda chunk: chunks.append(len(chunk))
+    )
+
+    assert importer.start("UTESTALICE", "alice")
+    assert notes.received.wait(30)
+
+    assert notes.messages == [("UTESTALICE", ":agabusiness: 1200 posts exported!")]
+    assert chunks == [500, 500, 200]
+    assert imported_posts(db, "alice") == 1200
+    job = db.ImportJob.get("UTESTALICE")
+    assert (job.status, job.processed, job.imported) == ("done", 1200, 1200)
+
+
+def test_only_one_job_per_user_runs(db):
+    assert db.ImportJob.claim("UTESTBOB", "bob")
+    assert not db.ImportJob.claim("UTESTBOB", "bob")
+    db.ImportJob.get("UTESTBOB").finish("done")
+    assert db.ImportJob.claim("UTESTBOB", "bob")
+
+
+def test_interrupted_job_resumes_from_its_checkpoint(db, scrapbook):
+    from importer import ScrapbookImporter
+
+    scrapbook.posts["carol"] = 1200
+    scrapbook.cut_after = 700
+    notes = Notes()
+    importer = ScrapbookImporter(notes, scrapbook.url, chunk_size=500)
+
+    assert importer.start("UTESTCAROL", "carol")
+    assert notes.received.wait(30)
+    job = db.ImportJob.get("UTESTCAROL")
+    assert (job.status, job.processed, job.imported) == ("failed", 500, 500)
+    assert "500 posts were imported" in notes.messages[0][1]
+
+    # As if the bot had been restarted in the middle of the job
+    job.status = "running"
+    db.session.commit()
+    scrapbook.cut_after = None
+    notes.received.clear()
+    importer.resume()
+    assert notes.received.wait(30)
+
+    job = db.ImportJob.get("UTESTCAROL")
+    assert (job.status, job.processed, job.imported) == ("done", 1200, 1200)
+    assert imported_posts(db, "carol") == 1200
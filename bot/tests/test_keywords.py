@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+from keywords import KeywordMatcher
+
+
+def write_reactions(path, kv, mtime=None):
+    path.write_text(json.dumps({"kv": kv, "blacklist": []}))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def reactions_file(tmp_path):
+    path = tmp_path / "reactions.json"
+    write_reactions(
+        path,
+        {"ts": "ts", "typescript": "ts", "python": "python", "hack club": "hackclub", "c++": "cpp"},
+        mtime=1_000_000,
+    )
+    return path
+
+
+def test_keywords_only_match_whole_words(reactions_file):
+    matcher = KeywordMatcher(str(reactions_file))
+
+    assert matcher.match("running the tests") == {}
+    assert matcher.match("Ported it to TS!") == {"ts": "ts"}
+    assert matcher.match("pythonic") == {}
+
+
+def test_phrases_with_spaces_or_punctuation_match(reactions_file):
+    matcher = KeywordMatcher(str(reactions_file))
+
+    assert matcher.match("python at Hack Club, then some c++") == {
+        "python": "python",
+        "hack club": "hackclub",
+        "c++": "cpp",
+    }
+    assert matcher.match("hack clubs") == {}
+
+
+def test_aliases_give_one_emoji(reactions_file):
+    matcher = KeywordMatcher(str(reactions_file))
+
+    matches = matcher.match("typescript, or ts for short")
+    assert list(matches) == ["typescript", "ts"]
+    assert list(dict.fromkeys(matches.values())) == ["ts"]
+
+
+def test_file_is_reloaded_when_it_changes(reactions_file):
+    matcher = KeywordMatcher(str(reactions_file))
+    assert matcher.match("rust") == {}
+
+    write_reactions(reactions_file, {"rust": "rust"}, mtime=2_000_000)
+    assert matcher.match("rust and ts") == {"rust": "rust"}
+
+
+def test_broken_file_keeps_the_last_good_version(reactions_file):
+    matcher = KeywordMatcher(str(reactions_file))
+
+    reactions_file.write_text("{not json")
+    os.utime(reactions_file, (2_000_000, 2_000_000))
+    assert matcher.match("ts") == {"ts": "ts"}
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import TEST_PREFIX
+
+
+@pytest.fixture(scope="module")
+def slack_files():
+    import fake_slack
+
+    server = fake_slack.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def mirror(slack_files, tmp_path):
+    from media import MediaMirror
+
+    return MediaMirror(
+        str(tmp_path),
+        "xoxb-test",
+        files_url=f"http://127.0.0.1:{slack_files.server_port}/files-pri/",
+        workers=2,
+        gc_interval=0,
+    )
+
+
+def ref(file_id, name):
+    return {"source": "slack", "id": file_id, "name": name}
+
+
+def blobs(mirror):
+    root = os.path.join(mirror.directory, "blobs")
+    return [name for prefix in os.listdir(root) for name in os.listdir(os.path.join(root, prefix))]
+
+
+def age_blobs(mirror):
+    """Make the blobs old enough for collect()."""
+    root = os.path.join(mirror.directory, "blobs")
+    old = time.time() - 2 * 3600
+    for prefix in os.listdir(root):
+        for name in os.listdir(os.path.join(root, prefix)):
+            os.utime(os.path.join(root, prefix, name), (old, old))
+
+
+def test_files_with_the_same_content_share_one_blob(mirror):
+    mirror.enqueue([ref("F1", "a.png")])
+    mirror.join()
+    mirror.enqueue([ref("F2", "b.png")])
+    mirror.join()
+
+    a = os.stat(mirror.path("F1", "a.png"))
+    b = os.stat(mirror.path("F2", "b.png"))
+    assert a.st_ino == b.st_ino and a.st_nlink == 3
+    assert len(blobs(mirror)) == 1
+    assert (mirror.stats()["mirrored"], mirror.stats()["deduplicated"]) == (1, 1)
+
+
+def test_percent_encoded_names_are_stored_decoded(mirror):
+    # Flask hands the API "my photo.png" for /file/F3/my%20photo.png
+    mirror.enqueue([ref("F3", "my%20photo.png")])
+    mirror.join()
+
+    assert os.path.isfile(os.path.join(mirror.directory, "files", "F3", "my photo.png"))
+    assert mirror.ref_path(ref("F3", "my%20photo.png")) == mirror.path("F3", "my photo.png")
+
+
+def test_removed_files_are_unlinked_and_their_blob_collected_once_unused(mirror):
+    mirror.enqueue([ref("F1", "a.png"), ref("F2", "b.png")])
+    mirror.join()
+    age_blobs(mirror)
+
+    mirror.remove([ref("F1", "a.png")])
+    assert not os.path.exists(os.path.join(mirror.directory, "files", "F1"))
+    assert mirror.collect() == 0
+    assert os.path.isfile(mirror.path("F2", "b.png"))
+
+    mirror.remove([ref("F2", "b.png")])
+    assert mirror.collect() == 1
+    assert blobs(mirror) == []
+    assert mirror.stats()["stored_bytes"] == 0
+
+
+def test_new_blobs_are_not_collected_before_they_are_linked(mirror):
+    mirror.enqueue([ref("F1", "a.png")])
+    mirror.join()
+    mirror.remove([ref("F1", "a.png")])
+
+    assert mirror.collect() == 0
+    assert len(blobs(mirror)) == 1
+
+
+def test_full_store_leaves_new_files_to_slack(mirror):
+    mirror.max_store_bytes = 4096
+    mirror.enqueue([ref("F1", "a.png")])
+    mirror.join()
+    mirror.enqueue([ref("F2", "b.png")])
+    mirror.join()
+
+    assert mirror.path("F2", "b.png") is not None
+    assert not os.path.exists(mirror.path("F2", "b.png"))
+    assert mirror.stats()["full"] == 1
+
+
+def test_deleted_post_stops_being_served_from_the_mirror(bot, db, slack_api):
+    message_id = f"{TEST_PREFIX}media-delete"
+    post = db.Post(
+        message_id=message_id,
+        author="UMEDIA",
+        message="x",
+        timestamp=datetime.now(timezone.utc),
+        tags=[],
+        files=["https://files.slack.com/files-pri/T0-F9/my%20photo.png"],
+    )
+    assert post.save()
+    # As if the download had finished
+    path = bot.media_mirror.ref_path(post.file_refs[0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+    bot.new_message(
+        {
+            "channel": "C09VC37P2NA",
+            "subtype": "message_deleted",
+            "previous_message": {"client_msg_id": message_id, "user": "UMEDIA"},
+        },
+        say=None,
+    )
+
+    assert not os.path.exists(path)
+    assert db.Post.get_by_id(message_id) is None
+
+
+def test_concurrent_stores_of_the_same_content_share_one_blob(tmp_path):
+    from media import MediaMirror
+
+    for trial in range(20):
+        mirror = MediaMirror(str(tmp_path / str(trial)), "xoxb-test", workers=0, gc_interval=0)
+        tmp_files = []
+        for i in range(4):
+            tmp_file = os.path.join(mirror.directory, "tmp", f"blob-{i}")
+            with open(tmp_file, "wb") as f:
+                f.write(b"same")
+            tmp_files.append(tmp_file)
+        threads = [
+            threading.Thread(target=mirror._store, args=(f"F{i}", "a.png", "ab" * 32, tmp_files[i], 4))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        blob = os.stat(os.path.join(mirror.directory, "blobs", "ab", "ab" * 32))
+        assert {os.stat(mirror.path(f"F{i}", "a.png")).st_ino for i in range(4)} == {blob.st_ino}
+        assert (mirror.stats()["mirrored"], mirror.stats()["deduplicated"]) == (1, 3)
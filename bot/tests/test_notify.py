@@ -0,0 +1,50 @@
+import json
+import select
+from datetime import datetime, timedelta, timezone
+
+from conftest import TEST_PREFIX
+from database import NOTIFY_CHANNEL, NOTIFY_MAX_BYTES, notify_statement
+
+
+def payload_of(statement):
+    return json.loads(statement.compile().params["payload"])
+
+
+def test_payload_names_author_and_tags():
+    assert payload_of(notify_statement("U1", ["b", "a", "b"])) == {"author": "U1", "tags": ["a", "b"]}
+
+
+def test_payload_too_long_for_postgres_falls_back_to_all_tags():
+    tags = [f"reaction-name-{i}" for i in range(1000)]
+    payload = payload_of(notify_statement("U1", tags))
+    assert payload == {"author": "U1", "all_tags": True}
+
+
+def test_save_batch_with_many_tags_commits_and_notifies(db):
+    conn = db.engine.raw_connection()
+    try:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+        start = datetime(2001, 1, 1, tzinfo=timezone.utc)
+        posts = [
+            db.Post(
+                message_id=f"{TEST_PREFIX}notify-{i}",
+                author="UTESTNOTIFY",
+                message="x",
+                timestamp=start + timedelta(seconds=i),
+                tags=[f"reaction-name-{i}-{j}" for j in range(4)],
+                files=[],
+            )
+            for i in range(200)
+        ]
+        assert len(json.dumps([tag for post in posts for tag in post.tags])) > NOTIFY_MAX_BYTES
+        assert db.Post.save_batch(posts) == 200
+
+        select.select([conn], [], [], 5)
+        conn.poll()
+        payloads = [json.loads(n.payload) for n in conn.notifies]
+        assert {"author": "UTESTNOTIFY", "all_tags": True} in payloads
+    finally:
+        conn.close()
@@ -0,0 +1,55 @@
+import time
+from datetime import datetime, timezone
+
+from conftest import TEST_PREFIX
+
+
+def saved_post(db, message_id, author):
+    post = db.Post(
+        message_id=message_id,
+        author=author,
+        message="x",
+        timestamp=datetime.now(timezone.utc),
+        tags=[],
+        files=[],
+    )
+    assert post.save()
+
+
+def test_flush_writes_the_tags_of_the_messages_it_could_fetch(bot, db, slack_api):
+    saved_post(db, f"{TEST_PREFIX}flush-ok", "UFLUSH")
+    slack_api.messages[("C1", "2.0")] = {
+        "ts": "2.0",
+        "client_msg_id": f"{TEST_PREFIX}flush-ok",
+        "reactions": [{"name": "fire", "users": ["UFLUSH"]}, {"name": "eyes", "users": ["USOMEONE"]}],
+    }
+    # The first message of the batch cannot be read
+    slack_api.script("conversations.history", {"error": "not_in_channel"})
+
+    bot.reaction_updates.flush({("C2", "1.0"): "UFLUSH", ("C1", "2.0"): "UFLUSH"})
+
+    db.session.expire_all()
+    assert db.Post.get_by_id(f"{TEST_PREFIX}flush-ok").tags == ["fire"]
+    assert [call.args["channel"] for call in slack_api.calls_to("conversations.history")] == ["C2", "C1"]
+
+
+def test_reaction_events_are_coalesced_into_one_fetch(bot, db, slack_api):
+    saved_post(db, f"{TEST_PREFIX}burst", "UBURST")
+    slack_api.messages[("C09VC37P2NA", "3.0")] = {
+        "ts": "3.0",
+        "client_msg_id": f"{TEST_PREFIX}burst",
+        "reactions": [{"name": "fire", "users": ["UBURST"]}],
+    }
+    event = {"user": "UBURST", "item_user": "UBURST", "item": {"channel": "C09VC37P2NA", "ts": "3.0"}}
+    for _ in range(5):
+        bot.handle_reaction(event, say=None, client=None)
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and not slack_api.calls_to("conversations.history"):
+        time.sleep(0.05)
+    # Past the quiet window: no second fetch follows
+    time.sleep(0.3)
+
+    assert len(slack_api.calls_to("conversations.history")) == 1
+    db.session.expire_all()
+    assert db.Post.get_by_id(f"{TEST_PREFIX}burst").tags == ["fire"]
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from slack_scheduler import CONFIRM, DECORATIVE, SlackScheduler, TokenBucket
+
+
+@pytest.fixture
+def client(slack_api):
+    return WebClient(token="xoxb-test", base_url=slack_api.url)
+
+
+def wait_all(futures, timeout=10):
+    return [future.result(timeout=timeout) for future in futures]
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=60, burst=2)
+    now = 100.0
+    bucket._updated = now
+    for _ in range(2):
+        assert bucket.ready_at(now) == now
+        bucket.take(now)
+    assert bucket.ready_at(now) == pytest.approx(now + 1)
+    assert bucket.ready_at(now + 1) == now + 1
+
+
+def test_token_bucket_pause_empties_it():
+    bucket = TokenBucket(rate=60, burst=10)
+    now = bucket._updated
+    bucket.pause(now + 5)
+    assert bucket.ready_at(now) == now + 5
+    assert bucket.tokens == 0
+
+
+def test_calls_beyond_the_burst_wait_for_the_rate(client, slack_api):
+    # 60 calls a minute: a burst of 10, then one a second
+    scheduler = SlackScheduler(client, workers=8, rates={"reactions_add": 60})
+    wait_all([scheduler.call("reactions_add", channel="C1", timestamp=str(i), name="x") for i in range(12)])
+
+    started = sorted(call.started for call in slack_api.calls_to("reactions.add"))
+    assert len(started) == 12
+    assert started[9] - started[0] < 0.8
+    assert started[10] - started[0] >= 0.8
+    assert started[11] - started[0] >= 1.8
+
+
+def test_429_pauses_the_method_for_retry_after(client, slack_api):
+    slack_api.script("reactions.add", {"status": 429, "retry_after": 1})
+    scheduler = SlackScheduler(client, workers=2)
+
+    start = time.monotonic()
+    response = scheduler.call("reactions_add", channel="C1", timestamp="1", name="x").result(timeout=10)
+
+    assert response["ok"]
+    calls = slack_api.calls_to("reactions.add")
+    assert [call.status for call in calls] == [429, 200]
+    assert calls[1].started - start >= 1
+    assert scheduler.stats()["throttled"] == 1
+    assert scheduler.stats()["retries"] == 1
+
+
+def test_confirmations_overtake_queued_reactions(client, slack_api):
+    # One worker, kept busy by a slow call while the others are queued
+    slack_api.script("conversations.history", {"delay": 0.3})
+    scheduler = SlackScheduler(client, workers=1)
+    busy = scheduler.call("conversations_history", channel="C1", latest="1", inclusive=True, limit=1)
+    time.sleep(0.1)
+
+    reactions = [
+        scheduler.call("reactions_add", channel="C1", timestamp=str(i), name="x", priority=DECORATIVE)
+        for i in range(3)
+    ]
+    confirm = scheduler.call("chat_postEphemeral", channel="C1", user="U1", text="saved", priority=CONFIRM)
+    wait_all([busy, confirm, *reactions])
+
+    order = [call.method for call in slack_api.calls]
+    assert order == ["conversations.history", "chat.postEphemeral"] + ["reactions.add"] * 3
+
+
+def test_transient_errors_are_retried_with_backoff(client, slack_api):
+    slack_api.script("chat.postMessage", {"status": 500, "error": "internal_error"}, {"error": "service_unavailable"})
+    scheduler = SlackScheduler(client, workers=2, backoff=0.05)
+
+    response = scheduler.call("chat_postMessage", channel="U1", text="hi").result(timeout=10)
+
+    assert response["ok"]
+    assert len(slack_api.calls_to("chat.postMessage")) == 3
+    assert scheduler.stats()["retries"] == 2
+
+
+def test_permanent_errors_fail_without_retry(client, slack_api):
+    slack_api.script("conversations.history", {"error": "not_in_channel"})
+    scheduler = SlackScheduler(client, workers=2, backoff=0.05)
+
+    with pytest.raises(SlackApiError):
+        scheduler.call("conversations_history", channel="C1", latest="1").result(timeout=10)
+    assert len(slack_api.calls_to("conversations.history")) == 1
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_ignored_errors_resolve_to_none(client, slack_api):
+    slack_api.script("reactions.add", {"error": "already_reacted"})
+    scheduler = SlackScheduler(client, workers=2)
+    future = scheduler.call("reactions_add", ignore_errors=("already_reacted",), channel="C1", timestamp="1", name="x")
+    assert future.result(timeout=10) is None
+
+
+def test_gives_up_after_max_attempts(client, slack_api):
+    slack_api.script("chat.postMessage", *[{"status": 503}] * 3)
+    scheduler = SlackScheduler(client, workers=1, max_attempts=3, backoff=0.01)
+
+    with pytest.raises(SlackApiError):
+        scheduler.call("chat_postMessage", channel="U1", text="hi").result(timeout=10)
+    assert len(slack_api.calls_to("chat.postMessage")) == 3